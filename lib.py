@@ -1,20 +1,47 @@
+import io
 import os
+import warnings
+import logging
+import re
+import json
+import hashlib
+import struct
+import socket
+import threading
 import math
+import time
+from time import perf_counter
 import numbers
-from collections.abc import Sequence
+import tempfile
+import itertools
+import contextlib
+import queue
+import shutil
+from fractions import Fraction
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
+from scipy import signal, special, sparse, linalg
+from scipy.sparse import linalg as sparse_linalg
 
 import matplotlib.pyplot as plt
+from PIL import Image
 
 import PySpice.Logging.Logging as Logging
 from PySpice.Unit import *
 from PySpice.Probe.Plot import plot
-from PySpice.Spice.NgSpice.Shared import NgSpiceShared
+from PySpice.Spice.NgSpice.Shared import NgSpiceShared, ffi
 from PySpice.Spice.Netlist import Circuit, SubCircuitFactory
-from PySpice.Probe.WaveForm import OperatingPoint
+from PySpice.Spice.Simulation import CircuitSimulation, CircuitSimulator
+from PySpice.Spice.BasicElement import (
+    Resistor, Capacitor, Inductor, VoltageSource, CurrentSource, Diode, SubCircuitElement)
+from PySpice.Spice.HighLevelElement import (
+    SinusoidalVoltageSource, SinusoidalCurrentSource, PulseVoltageSource, PulseCurrentSource)
+from PySpice.Probe.WaveForm import OperatingPoint, DcAnalysis, AcAnalysis, TransientAnalysis, WaveForm
 from PySpice.Doc.ExampleTools import find_libraries
 from PySpice.Spice.Library import SpiceLibrary
+from PySpice.Tools.StringTools import str_spice
 from PySpice.Physics.SemiConductor import ShockleyDiode
 
 
@@ -22,6 +49,14 @@ logger = Logging.setup_logging()
 
 ASSET_PATH = os.path.join(os.getcwd(), 'assets')
 
+CACHE_PATH = os.path.join(os.getcwd(), '.cache')
+CAPTURE_CACHE_PATH = os.path.join(CACHE_PATH, 'captures')
+CAPTURE_CACHE_MAX_BYTES = 1 << 30
+DIGITIZED_CACHE_PATH = os.path.join(CACHE_PATH, 'digitized')
+SIMULATION_CACHE_PATH = os.path.join(CACHE_PATH, 'simulations')
+SIMULATION_CACHE_MAX_BYTES = 1 << 30
+RPM_SWEEP_CACHE_PATH = os.path.join(CACHE_PATH, 'rpm_sweep')
+
 libraries_path = os.path.join(ASSET_PATH, 'examples')
 spice_library = SpiceLibrary(libraries_path)
 # spice_library = SpiceLibrary('/lib/')
@@ -33,67 +68,1647 @@ __all__ = [
     'parallel_resistor_circuit',
     'raw_spice_circuit',
     'read_num_from_text_file',
+    'load_num_array_from_text_file',
+    'iter_num_chunks_from_text_file',
+    'load_cached_num_array_from_text_file',
+    'WaveformSource',
+    'StreamingWaveformSource',
+    'SocketWaveformSource',
+    'serve_samples',
+    'Capture',
+    'read_scope_csv',
+    'read_scope_binary',
+    'write_scope_binary',
+    'resample_capture',
+    'digitize_scope_image',
+    'digitize_scope_images',
+    'CallbackStats',
+    'NgSpicePool',
+    'get_ngspice_pool',
+    'prepare_ngspice_libraries',
+    'MyNgSpiceShared',
+    'StreamingRecorder',
+    'stream_transient',
+    'ThresholdCrossings',
+    'transient_until',
     'rectifier_circuit',
+    'SortedLookup',
     'engine_pickup_sensor_circuit',
     'engine_pickup_sensor_circuit_2',
+    'SOURCE_MODES',
+    'add_waveform_voltage_source',
+    'add_waveform_current_source',
+    'pickup_sensor_circuit',
+    'benchmark_source_modes',
+    'input_bandwidth',
+    'circuit_time_constants',
+    'propose_timestep',
+    'timestep_convergence_study',
+    'select_pickup_timestep',
+    'periodic_steady_state',
+    'pickup_steady_cycle',
+    'TransferCurve',
+    'pickup_transfer_curve',
+    'DiodeClamp',
+    'diode_clamp_accuracy',
+    'parameter_grid',
+    'sweep_pickup_sensor_circuit',
+    'edge_times',
+    'edge_delays',
+    'RPM_METRICS',
+    'sweep_pickup_rpm',
+    'write_rpm_table',
+    'waveform_hash',
+    'SimulationCache',
+    'CachedSimulator',
+    'MnaCircuitSimulator',
+    'SIMULATOR_BACKENDS',
+    'LinearStateSpace',
+    'LinearNetworkFilter',
+    'FrequencyResponse',
+    'characterise_frequency_response',
+    'overlap_save',
+    'cross_check_mna',
+    'cross_check_circuits',
 ]
 
 
 
 
+# Lines 'float()' would accept, used to drop headers and junk in bulk
+NUMBER_LINE_PATTERN = re.compile(
+    r'^\s*[-+]?((\d+\.?\d*|\.\d+)([eE][-+]?\d+)?|nan|inf|infinity)\s*$', re.IGNORECASE)
+
+def _parse_num_lines(lines:list, dtype=np.float64) -> np.ndarray:
+    """ Converts a block of lines to an array, skipping non-numeric lines. """
+    try:
+        return np.array(lines, dtype=dtype)
+    except ValueError:
+        # Slow path, only for blocks holding headers or junk
+        lines = [line for line in lines if NUMBER_LINE_PATTERN.match(line)]
+        return np.array(lines, dtype=dtype)
+
+def iter_num_chunks_from_text_file(
+        filename:str="No load.txt", chunk_size:int=1 << 16, dtype=np.float64):
+    """ 
+    Yields arrays of 'chunk_size' numbers (the last one may be shorter) read from a text file
+    with one number per line, so large captures never have to be fully in RAM.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive.")
+    path = os.path.join(ASSET_PATH, filename)
+    carry = np.empty(0, dtype=dtype)
+    with open(path) as file:
+        while True:
+            lines = list(itertools.islice(file, chunk_size))
+            if not lines:
+                break
+            numbers = _parse_num_lines(lines, dtype)
+            if carry.size:
+                numbers = np.concatenate((carry, numbers))
+            n_full = numbers.size // chunk_size * chunk_size
+            for start in range(0, n_full, chunk_size):
+                yield numbers[start:start + chunk_size]
+            carry = numbers[n_full:]
+    if carry.size:
+        yield carry
+
+def load_num_array_from_text_file(
+        filename:str="No load.txt", dtype=np.float64, chunk_size:int=1 << 16) -> np.ndarray:
+    """ Reads numbers per line from text file into a single array. """
+    chunks = list(iter_num_chunks_from_text_file(filename, chunk_size=chunk_size, dtype=dtype))
+    if not chunks:
+        return np.empty(0, dtype=dtype)
+    return np.concatenate(chunks)
+
 def read_num_from_text_file(filename:str="No load.txt") -> list[float]:
     """ Reads numbers per line from text file """
-    numbers = []
+    return load_num_array_from_text_file(filename).tolist()
+
+
+def _file_digest(path:str, chunk_size:int=1 << 20) -> str:
+    """ sha256 of a file's content, read in chunks. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _evict_lru(directory:str, max_bytes:int, keep:Sequence=()):
+    """ 
+    Removes the least recently used cache entries until 'directory' fits in 'max_bytes'.
+    Files sharing a name stem ('key.npy', 'key.json') form one entry; use is tracked by mtime.
+    Entries whose stem is in 'keep' (e.g. the one just written) are never removed.
+    """
+    entries = dict()
+    for entry in os.scandir(directory):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        stem = entry.name.split('.', 1)[0]
+        size, last_used, paths = entries.get(stem, (0, 0, []))
+        entries[stem] = (size + stat.st_size, max(last_used, stat.st_mtime), paths + [entry.path])
+    total = sum(size for size, _, _ in entries.values())
+    for stem, (size, _, paths) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+        if total <= max_bytes:
+            break
+        if stem in keep:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+def load_cached_num_array_from_text_file(
+        filename:str="No load.txt", dtype=np.float64, cache_dir:str=None,
+        max_bytes:int=CAPTURE_CACHE_MAX_BYTES) -> np.ndarray:
+    """ 
+    Same as load_num_array_from_text_file, with a '.npy' sidecar cache.
+    The first call parses the text and writes the sidecar, later calls memory-map it.
+    Sidecars are invalidated when the source size/mtime change and its content hash differs.
+    """
+    cache_dir = cache_dir if cache_dir is not None else CAPTURE_CACHE_PATH
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(ASSET_PATH, filename))
+    stat = os.stat(path)
+    key = hashlib.sha1('{}|{}'.format(path, np.dtype(dtype).str).encode()).hexdigest()
+    npy_path = os.path.join(cache_dir, key + '.npy')
+    meta_path = os.path.join(cache_dir, key + '.json')
+
+    meta = None
+    if os.path.exists(npy_path) and os.path.exists(meta_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+        if (meta['size'], meta['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            # Touched or rewritten, only the content hash can tell
+            if meta['size'] == stat.st_size and meta['sha256'] == _file_digest(path):
+                meta['mtime_ns'] = stat.st_mtime_ns
+                with open(meta_path, 'w') as file:
+                    json.dump(meta, file)
+            else:
+                meta = None
+
+    if meta is None:
+        numbers = load_num_array_from_text_file(path, dtype=dtype)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as file:
+            np.save(file, numbers)
+        os.replace(file.name, npy_path)
+        meta = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_digest(path), 'dtype': np.dtype(dtype).str}
+        with open(meta_path, 'w') as file:
+            json.dump(meta, file)
+        _evict_lru(cache_dir, max_bytes, keep=(key,))
+    else:
+        # Mark as recently used for the LRU eviction
+        os.utime(npy_path)
+    return np.load(npy_path, mmap_mode='r')
+
+def _default_voltages(voltages=None) -> np.ndarray:
+    """ 'voltages' as float64, the cached capture when None. """
+    return np.asarray(voltages if voltages is not None else load_cached_num_array_from_text_file(),
+        dtype=np.float64)
+
+
+def _check_interpolation(interpolation:str):
+    if interpolation not in WaveformSource.INTERPOLATIONS:
+        raise ValueError("interpolation '{}' is not one of {}.".format(interpolation, WaveformSource.INTERPOLATIONS))
+
+def _sample_position(time:float, start_time:float, rate:float, sample_time) -> tuple:
+    """ 
+    (index, fraction) of 'time' on a uniform grid: the last sample at or before it and how far
+    it is towards the next one (0..1). (time - start_time) * rate rounds either way at sample
+    instants, so the truncated index is settled against sample_time(index), the grid's own times.
+    """
+    position = (time - start_time) * rate
+    index = int(position)
+    if sample_time(index + 1) <= time:
+        index += 1
+    elif index > 0 and sample_time(index) > time:
+        index -= 1
+    return index, min(max(position - index, 0.0), 1.0)
+
+
+class WaveformSource:
+    """ 
+    Time indexed waveform for external sources.
+    Returns the value at any requested time, so repeated or rejected
+    ngspice timesteps read the same sample instead of consuming the capture.
+    """
+
+    INTERPOLATIONS = ('linear', 'hold')
+
+    def __init__(self, times, values, interpolation:str='linear', default_value:float=0):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.times.ndim != 1 or self.times.shape != self.values.shape:
+            raise ValueError("times and values must be 1-D arrays of the same length.")
+        if self.times.size == 0:
+            raise ValueError("WaveformSource needs at least one sample.")
+        if np.any(np.diff(self.times) < 0):
+            raise ValueError("times must be non-decreasing.")
+        _check_interpolation(interpolation)
+        self.interpolation = interpolation
+        self.default_value = default_value
+
+        # Cached scalars for the callback hot path
+        self._hold = interpolation == 'hold'
+        self._last = self.times.size - 1
+        self._start_time = self.times.item(0)
+        self._end_time = self.times.item(self._last)
+        self._rate = None
+        if self._last > 0:
+            steps = np.diff(self.times)
+            if steps[0] > 0 and np.allclose(steps, steps[0], rtol=1e-9, atol=0):
+                self._rate = self._last / (self._end_time - self._start_time)
+
+    @classmethod
+    def from_samples(cls, values, step_time:float, start_time:float=0, **kwargs):
+        """ Create a source from uniformly sampled values. """
+        values = np.asarray(values, dtype=np.float64)
+        times = start_time + step_time * np.arange(values.size)
+        return cls(times, values, **kwargs)
+
+    @property
+    def is_uniform(self) -> bool:
+        return self._rate is not None
+
+    @property
+    def start_time(self) -> float:
+        return self._start_time
+
+    @property
+    def end_time(self) -> float:
+        return self._end_time
+
+    def _sample_time(self, index:int) -> float:
+        return self.times.item(index) if index <= self._last else math.inf
+
+    def _index(self, time:float) -> int:
+        """ Index of the last sample at or before 'time'. """
+        if self._rate is not None:
+            index, _ = _sample_position(time, self._start_time, self._rate, self._sample_time)
+            return min(index, self._last)
+        return int(np.searchsorted(self.times, time, side='right')) - 1
+
+    def __call__(self, time:float) -> float:
+        """ Value at 'time'. O(1) for uniform sampling, else O(log n). """
+        if time < self._start_time or time > self._end_time:
+            return self.default_value
+        i = self._index(time)
+        if self._hold or i >= self._last:
+            return self.values.item(i)
+        t0, t1 = self.times.item(i), self.times.item(i + 1)
+        v0, v1 = self.values.item(i), self.values.item(i + 1)
+        if t1 == t0:
+            return v1
+        return v0 + (time - t0) * (v1 - v0) / (t1 - t0)
+
+    def sample(self, times) -> np.ndarray:
+        """ Vectorized version of calling the source for an array of times. """
+        times = np.asarray(times, dtype=np.float64)
+        if self._hold:
+            indices = np.searchsorted(self.times, times, side='right') - 1
+            result = self.values[np.clip(indices, 0, self._last)]
+        else:
+            result = np.interp(times, self.times, self.values)
+        outside = (times < self._start_time) | (times > self._end_time)
+        return np.where(outside, self.default_value, result)
+
+
+class StreamingWaveformSource:
+    """ 
+    Uniformly sampled waveform read lazily from an iterator of samples or sample blocks,
+    e.g. iter_num_chunks_from_text_file or a synthetic generator.
+    Only a bounded window of samples around the current simulation time is held,
+    'history' samples are kept behind it for rejected/repeated ngspice timesteps.
+    """
+
+    def __init__(
+            self, samples, step_time:float, start_time:float=0, interpolation:str='linear',
+            default_value:float=0, history:int=1 << 14):
+        _check_interpolation(interpolation)
+        if step_time <= 0:
+            raise ValueError("step_time must be positive.")
+        self.step_time = step_time
+        self.interpolation = interpolation
+        self.default_value = default_value
+        self.history = history
+        # Requests older than the kept history are served the oldest kept sample
+        self.history_misses = 0
+
+        self._blocks = (np.atleast_1d(np.asarray(block, dtype=np.float64)).ravel() for block in samples)
+        self._hold = interpolation == 'hold'
+        self._start_time = start_time
+        self._rate = 1 / step_time
+        self._buffer = np.empty(0, dtype=np.float64)
+        self._offset = 0  # sample index of self._buffer[0]
+        self._exhausted = False
+
+    @property
+    def start_time(self) -> float:
+        return self._start_time
+
+    @property
+    def end_time(self) -> float:
+        """ Time of the last sample, None until the iterator is exhausted. """
+        if not self._exhausted:
+            return None
+        return self._start_time + (self._offset + self._buffer.size - 1) * self.step_time
+
+    def _fill(self, index:int):
+        """ Reads blocks until sample 'index' is buffered (or the iterator ends). """
+        blocks = [self._buffer]
+        available = self._offset + self._buffer.size
+        while available <= index:
+            block = next(self._blocks, None)
+            if block is None:
+                self._exhausted = True
+                break
+            blocks.append(block)
+            available += block.size
+        # Drop what is older than the history behind the requested sample
+        drop = max(0, min(index, available) - self.history - self._offset)
+        buffer = np.concatenate(blocks) if len(blocks) > 1 else self._buffer
+        self._buffer = buffer[drop:].copy() if drop else buffer
+        self._offset += drop
+
+    def _value(self, index:int) -> float:
+        return self._buffer.item(index - self._offset)
+
+    def _sample_time(self, index:int) -> float:
+        return self._start_time + index * self.step_time
+
+    def __call__(self, time:float) -> float:
+        """ Value at 'time', reading further samples from the iterator when needed. """
+        if time < self._start_time:
+            return self.default_value
+        index, fraction = _sample_position(time, self._start_time, self._rate, self._sample_time)
+        if index + 1 >= self._offset + self._buffer.size and not self._exhausted:
+            self._fill(index + 1)
+        if index < self._offset:
+            self.history_misses += 1
+            index, fraction = self._offset, 0.0
+        last = self._offset + self._buffer.size - 1
+        if index > last or (index == last and time > self._sample_time(index)):
+            return self.default_value
+        if self._hold or index == last:
+            return self._value(index)
+        v0 = self._value(index)
+        return v0 + fraction * (self._value(index + 1) - v0)
+
+
+def _open_socket(address) -> socket.socket:
+    """ TCP socket for a (host, port) address, Unix socket for a path. """
+    if isinstance(address, (str, os.PathLike)):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+class SocketWaveformSource:
+    """ 
+    Samples streamed over a local TCP or Unix socket (little-endian 'dtype', sample_rate Hz),
+    received by a background thread into a ring buffer of 'capacity' samples.
+    The receiver thread only advances 'received' after writing, the simulation thread only reads,
+    so no lock is needed between them.
+    back_pressure, when the simulation asks for a sample not received yet:
+    - 'block': wait up to 'block_timeout' seconds for it, then hold the last value
+    - 'hold': return the last received value
+    - 'zero': return default_value
+    In 'block' mode the receiver also stops reading from the socket while the ring is full
+    ('history' samples are kept behind the latest requested one), which throttles the producer.
+    The other modes never stall the producer, overwritten samples are counted in 'overruns'.
+    """
+
+    BACK_PRESSURES = ('block', 'hold', 'zero')
+
+    def __init__(
+            self, address, sample_rate:float, capacity:int=1 << 20, back_pressure:str='hold',
+            interpolation:str='linear', default_value:float=0, block_timeout:float=1.0,
+            dtype:str='<f4', start_time:float=0, history:int=None):
+        if back_pressure not in self.BACK_PRESSURES:
+            raise ValueError("back_pressure '{}' is not one of {}.".format(back_pressure, self.BACK_PRESSURES))
+        _check_interpolation(interpolation)
+        self.address = address
+        self.sample_rate = sample_rate
+        self.back_pressure = back_pressure
+        self.interpolation = interpolation
+        self.default_value = default_value
+        self.block_timeout = block_timeout
+        self.dtype = np.dtype(dtype)
+        self.history = history if history is not None else capacity // 4
+
+        # Counters
+        self.received = 0
+        self.underruns = 0
+        self.overruns = 0
+
+        self._hold = interpolation == 'hold'
+        self._start_time = start_time
+        self._requested = 0  # latest sample index asked for by the simulation
+        self._buffer = np.zeros(capacity, dtype=np.float64)
+        self._capacity = capacity
+        self._closed = threading.Event()
+        self._connected = threading.Event()
+        self._socket = _open_socket(address)
+        self._socket.connect(address)
+        self._connected.set()
+        self._thread = threading.Thread(target=self._receive, name='SocketWaveformSource', daemon=True)
+        self._thread.start()
+
+    @property
+    def start_time(self) -> float:
+        return self._start_time
+
+    @property
+    def is_receiving(self) -> bool:
+        return self._thread.is_alive()
+
+    def _receive(self):
+        """ Background thread: socket -> ring buffer. """
+        itemsize = self.dtype.itemsize
+        pending = b''
+        try:
+            while not self._closed.is_set():
+                data = self._socket.recv(1 << 16)
+                if not data:
+                    break
+                data = pending + data
+                n_bytes = len(data) // itemsize * itemsize
+                pending = data[n_bytes:]
+                samples = np.frombuffer(data[:n_bytes], dtype=self.dtype)
+                if self.back_pressure != 'block':
+                    self._write(samples)
+                    continue
+                while samples.size and not self._closed.is_set():
+                    # Not reading the socket meanwhile lets the producer's sends block
+                    free = self._capacity - self.received + max(self._requested - self.history, 0)
+                    if free <= 0:
+                        time.sleep(1e-4)
+                        continue
+                    self._write(samples[:free])
+                    samples = samples[free:]
+        except OSError:
+            if not self._closed.is_set():
+                raise
+        finally:
+            self._socket.close()
+
+    def _write(self, samples:np.ndarray):
+        """ Appends samples to the ring, publishing them once they are in place. """
+        n_samples = samples.size
+        # Keep only what fits, older samples would be overwritten anyway
+        samples = samples[-self._capacity:]
+        start = (self.received + n_samples - samples.size) % self._capacity
+        first = min(samples.size, self._capacity - start)
+        self._buffer[start:start + first] = samples[:first]
+        self._buffer[:samples.size - first] = samples[first:]
+        self.received += n_samples
+
+    def close(self):
+        self._closed.set()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _sample_time(self, index:int) -> float:
+        return self._start_time + index / self.sample_rate
+
+    def _wait_for(self, index:int) -> bool:
+        deadline = time.perf_counter() + self.block_timeout
+        while self.received <= index and self._thread.is_alive():
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(1e-4)
+        return self.received > index
+
+    def __call__(self, time:float) -> float:
+        """ Value at 'time' from the ring buffer, applying back_pressure on underruns. """
+        if time < self._start_time:
+            return self.default_value
+        index, fraction = _sample_position(time, self._start_time, self.sample_rate, self._sample_time)
+        if index > self._requested:
+            self._requested = index
+        received = self.received
+        if index >= received:
+            if self.back_pressure == 'block' and self._wait_for(index):
+                received = self.received
+            else:
+                self.underruns += 1
+                if self.back_pressure == 'zero' or received == 0:
+                    return self.default_value
+                return self._buffer.item((received - 1) % self._capacity)
+        if index < received - self._capacity:
+            # Already overwritten, the simulation is too slow for the buffer
+            self.overruns += 1
+            index, fraction = received - self._capacity, 0.0
+        v0 = self._buffer.item(index % self._capacity)
+        if self._hold or index + 1 >= received:
+            return v0
+        return v0 + fraction * (self._buffer.item((index + 1) % self._capacity) - v0)
+
+
+def serve_samples(address, blocks, sample_rate:float=None, dtype:str='<f4', ready:threading.Event=None):
+    """ 
+    Stand-in for a bench DAQ: listens on 'address', accepts one client and streams
+    'blocks' (arrays of samples) to it. With 'sample_rate' the stream is paced in real time.
+    """
+    server = _open_socket(address)
+    if isinstance(address, (str, os.PathLike)) and os.path.exists(address):
+        os.remove(address)
+    server.bind(address)
+    server.listen(1)
+    if ready is not None:
+        ready.set()
+    try:
+        connection, _ = server.accept()
+        with connection:
+            sent = 0
+            start = time.perf_counter()
+            for block in blocks:
+                block = np.atleast_1d(np.asarray(block, dtype=dtype)).ravel()
+                if sample_rate is not None:
+                    delay = start + sent / sample_rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                try:
+                    connection.sendall(block.tobytes())
+                except (BrokenPipeError, ConnectionResetError):
+                    # The simulation has what it needs
+                    break
+                sent += block.size
+    finally:
+        server.close()
+        if isinstance(address, (str, os.PathLike)) and os.path.exists(address):
+            os.remove(address)
+
+
+class Capture:
+    """ Sampled channels sharing one timebase, as exported by a scope. """
+
+    def __init__(self, times, channels:dict):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.channels = {name: np.asarray(values) for name, values in channels.items()}
+        for name, values in self.channels.items():
+            if values.shape != self.times.shape:
+                raise ValueError("Channel '{}' has {} samples, the timebase {}.".format(
+                    name, values.shape, self.times.shape))
+
+    @classmethod
+    def from_samples(cls, values, step_time:float, start_time:float=0, channel:str='CH1'):
+        """ Single channel capture from uniformly sampled values. """
+        values = np.asarray(values)
+        return cls(start_time + step_time * np.arange(values.size), {channel: values})
+
+    def __getitem__(self, channel:str) -> np.ndarray:
+        return self.channels[channel]
+
+    def __len__(self) -> int:
+        return self.times.size
+
+    @property
+    def channel_names(self) -> list:
+        return list(self.channels.keys())
+
+    @property
+    def step_time(self) -> float:
+        """ Median sample interval, robust to jitter in the exported timestamps. """
+        return float(np.median(np.diff(self.times)))
+
+    @property
+    def sample_rate(self) -> float:
+        return 1 / self.step_time
+
+    @property
+    def start_time(self) -> float:
+        return self.times.item(0)
+
+    @property
+    def end_time(self) -> float:
+        return self.times.item(-1)
+
+    def source(self, channel:str=None, **kwargs) -> WaveformSource:
+        """ WaveformSource for 'channel', the first channel by default. """
+        channel = channel if channel is not None else self.channel_names[0]
+        return WaveformSource(self.times, self.channels[channel], **kwargs)
+
+
+def _split_csv_line(line:str, delimiter:str) -> list:
+    """ Fields without surrounding quotes, trailing empty fields ('TIME,CH1,') dropped. """
+    fields = [field.strip().strip('"').strip("'") for field in line.split(delimiter)]
+    while fields and not fields[-1]:
+        fields.pop()
+    return fields
+
+def _parse_csv_lines(lines:list, delimiter:str, n_columns:int, dtype) -> np.ndarray:
+    """ Converts a block of CSV lines to a 2-D array, skipping non-numeric rows. """
+    try:
+        return np.loadtxt(lines, delimiter=delimiter, dtype=dtype, ndmin=2, usecols=range(n_columns),
+            quotechar='"').reshape(-1, n_columns)
+    except ValueError:
+        rows = [fields for fields in (_split_csv_line(line, delimiter) for line in lines)
+            if len(fields) == n_columns and all(NUMBER_LINE_PATTERN.match(field) for field in fields)]
+        if not rows:
+            return np.empty((0, n_columns), dtype=dtype)
+        return np.array(rows, dtype=np.float64).astype(dtype, copy=False)
+
+def read_scope_csv(
+        filename:str, time_column=0, delimiter:str=',', dtype=np.float64,
+        chunk_size:int=1 << 16) -> Capture:
+    """ 
+    Reads a multi-column scope CSV export: optional header lines, then one row per sample.
+    'time_column' is the index or the header name of the time column, the
+    other columns become channels named after the header (or 'CH1', 'CH2', ...).
+    The file is parsed in blocks of 'chunk_size' rows.
+    """
     path = os.path.join(ASSET_PATH, filename)
+    header = None
+    blocks = []
     with open(path) as file:
-        for line in file.readlines():
+        # Header lines: everything before the first numeric row
+        for line in file:
+            fields = _split_csv_line(line, delimiter)
+            if fields and all(NUMBER_LINE_PATTERN.match(field) for field in fields):
+                first_row = line
+                break
+            if fields:
+                header = fields
+        else:
+            raise ValueError("'{}' holds no numeric rows.".format(path))
+        n_columns = len(_split_csv_line(first_row, delimiter))
+        lines = itertools.chain((first_row,), file)
+        while True:
+            block = list(itertools.islice(lines, chunk_size))
+            if not block:
+                break
+            blocks.append(_parse_csv_lines(block, delimiter, n_columns, dtype))
+    data = np.concatenate(blocks)
+
+    if header is None or len(header) != n_columns:
+        header = ['time'] + ['CH{}'.format(i) for i in range(1, n_columns)]
+    if not isinstance(time_column, numbers.Integral):
+        time_column = header.index(time_column)
+    channels = {name: data[:, i] for i, name in enumerate(header) if i != time_column}
+    return Capture(data[:, time_column], channels)
+
+
+# Raw binary capture: header, per channel (scale, offset) pairs, then interleaved little-endian samples.
+# magic, sample format (see SCOPE_BINARY_FORMATS), channels, samples, sample interval (s), start time (s)
+SCOPE_BINARY_MAGIC = b'SCOP'
+SCOPE_BINARY_HEADER = struct.Struct('<4sBBxxQdd')
+SCOPE_BINARY_CHANNEL = struct.Struct('<dd')
+SCOPE_BINARY_FORMATS = {0: np.dtype('<i2'), 1: np.dtype('<f4')}
+
+def read_scope_binary(filename:str, channel_names:Sequence=None) -> Capture:
+    """ 
+    Reads a raw binary capture. Samples are memory-mapped and scaled to volts
+    with 'value * scale + offset' per channel.
+    """
+    path = os.path.join(ASSET_PATH, filename)
+    with open(path, 'rb') as file:
+        magic, sample_format, n_channels, n_samples, sample_interval, start_time = \
+            SCOPE_BINARY_HEADER.unpack(file.read(SCOPE_BINARY_HEADER.size))
+        if magic != SCOPE_BINARY_MAGIC:
+            raise ValueError("'{}' is not a scope binary capture.".format(path))
+        if sample_format not in SCOPE_BINARY_FORMATS:
+            raise ValueError("Unknown sample format {} in '{}'.".format(sample_format, path))
+        scales_offsets = [SCOPE_BINARY_CHANNEL.unpack(file.read(SCOPE_BINARY_CHANNEL.size))
+            for _ in range(n_channels)]
+    raw = np.memmap(path, dtype=SCOPE_BINARY_FORMATS[sample_format], mode='r',
+        offset=SCOPE_BINARY_HEADER.size + n_channels*SCOPE_BINARY_CHANNEL.size,
+        shape=(n_samples, n_channels))
+
+    channel_names = channel_names if channel_names is not None \
+        else ['CH{}'.format(i) for i in range(1, n_channels + 1)]
+    channels = {name: raw[:, i].astype(np.float64) * scale + offset
+        for i, (name, (scale, offset)) in enumerate(zip(channel_names, scales_offsets))}
+    times = start_time + sample_interval * np.arange(n_samples)
+    return Capture(times, channels)
+
+def write_scope_binary(filename:str, capture:Capture, sample_format:int=1):
+    """ Writes 'capture' in the raw binary format read by read_scope_binary. """
+    path = os.path.join(ASSET_PATH, filename)
+    dtype = SCOPE_BINARY_FORMATS[sample_format]
+    values = np.column_stack([capture[name] for name in capture.channel_names])
+    scales_offsets = []
+    for i in range(values.shape[1]):
+        if dtype.kind == 'i':
+            # Spread the channel over the full int16 range
+            low, high = values[:, i].min(), values[:, i].max()
+            offset = (high + low) / 2
+            scale = max(high - low, np.finfo(np.float64).tiny) / (2*np.iinfo(dtype).max)
+        else:
+            scale, offset = 1.0, 0.0
+        scales_offsets.append((scale, offset))
+        values[:, i] = (values[:, i] - offset) / scale
+    if dtype.kind == 'i':
+        values = np.rint(values)
+    with open(path, 'wb') as file:
+        file.write(SCOPE_BINARY_HEADER.pack(SCOPE_BINARY_MAGIC, sample_format, values.shape[1],
+            values.shape[0], capture.step_time, capture.start_time))
+        for scale, offset in scales_offsets:
+            file.write(SCOPE_BINARY_CHANNEL.pack(scale, offset))
+        file.write(values.astype(dtype).tobytes())
+
+
+def resample_capture(
+        capture:Capture, sample_rate:float, bandwidth:float=None,
+        max_denominator:int=1000, filter_order:int=8) -> Capture:
+    """ 
+    Resamples every channel of 'capture' to 'sample_rate' (Hz).
+    Uses polyphase rational resampling (scipy.signal.resample_poly), whose FIR
+    filter removes content above the new Nyquist frequency. The ratio is approximated
+    with a denominator of at most 'max_denominator', see Capture.sample_rate on the result.
+    bandwidth: optionally band-limit (zero-phase Butterworth) to the pickup bandwidth (Hz) first.
+    Non-uniform timebases are first interpolated onto their median sample interval.
+    """
+    step_time = capture.step_time
+    times = capture.times
+    channels = capture.channels
+    if not np.allclose(np.diff(times), step_time, rtol=1e-6, atol=0):
+        n_samples = int(round((capture.end_time - capture.start_time) / step_time)) + 1
+        times = capture.start_time + step_time * np.arange(n_samples)
+        channels = {name: np.interp(times, capture.times, values) for name, values in channels.items()}
+
+    if bandwidth is not None:
+        if not 0 < bandwidth < capture.sample_rate / 2:
+            raise ValueError("bandwidth must be between 0 and the capture's Nyquist frequency.")
+        sos = signal.butter(filter_order, bandwidth, fs=1 / step_time, output='sos')
+        channels = {name: signal.sosfiltfilt(sos, values) for name, values in channels.items()}
+
+    ratio = Fraction(sample_rate * step_time).limit_denominator(max_denominator)
+    if ratio == 0:
+        raise ValueError("sample_rate {} Hz is too low for this capture.".format(sample_rate))
+    up, down = ratio.numerator, ratio.denominator
+    if up == down:
+        return Capture(times, channels)
+    channels = {name: signal.resample_poly(values, up, down) for name, values in channels.items()}
+    n_samples = next(iter(channels.values())).size
+    new_times = times.item(0) + step_time * down / up * np.arange(n_samples)
+    return Capture(new_times, channels)
+
+
+def _find_plot_box(image:np.ndarray, line_fraction:float=0.5) -> tuple:
+    """ 
+    Finds the graticule frame of a scope screenshot as (left, top, right, bottom) pixels.
+    Frame lines are bright grey rows/columns; the frame is the pair of lines closest to
+    the image centre that are still at least a quarter of the image away from it.
+    """
+    saturation = image.max(axis=2) - image.min(axis=2)
+    grey = (image.max(axis=2) > 150) & (saturation < 40)
+    box = []
+    for axis, size in ((0, image.shape[1]), (1, image.shape[0])):
+        lines = np.flatnonzero(grey.mean(axis=axis) > line_fraction)
+        centre = size / 2
+        before = lines[lines <= centre - size/4]
+        after = lines[lines >= centre + size/4]
+        if before.size == 0 or after.size == 0:
+            raise ValueError("Could not find the graticule frame, pass plot_box.")
+        box.append((before.max(), after.min()))
+    (left, right), (top, bottom) = box
+    return int(left), int(top), int(right), int(bottom)
+
+def _dominant_trace_colour(pixels:np.ndarray, min_saturation:int=80) -> np.ndarray:
+    """ Most common saturated colour, quantised to 32 levels per channel. """
+    pixels = pixels.reshape(-1, 3)
+    saturated = pixels[(pixels.max(axis=1) - pixels.min(axis=1)) > min_saturation]
+    if saturated.size == 0:
+        raise ValueError("No coloured trace found, pass trace_colour.")
+    quantised = saturated // 8
+    codes = (quantised[:, 0] << 10) | (quantised[:, 1] << 5) | quantised[:, 2]
+    code = np.bincount(codes).argmax()
+    return saturated[codes == code].mean(axis=0)
+
+def digitize_scope_image(
+        filename:str, volts_per_division:float=1.0, seconds_per_division:float=50e-3,
+        divisions:tuple=(10, 8), plot_box:tuple=None, trace_colour:Sequence=None,
+        colour_tolerance:float=80, zero_offset_divisions:float=0, reduce:str='mean',
+        channel:str='CH1', cache_dir:str=None) -> Capture:
+    """ 
+    Digitizes the trace of a scope screenshot, one sample per pixel column.
+    - divisions: graticule (horizontal, vertical) divisions inside plot_box
+    - plot_box: (left, top, right, bottom) pixels of the graticule, found automatically by default
+    - trace_colour: RGB of the trace, the dominant saturated colour by default
+    - zero_offset_divisions: ground level above the vertical centre, in divisions
+    - reduce: how rows of one column combine, 'mean' or 'extreme' (farthest from ground)
+    Columns without trace pixels are linearly interpolated.
+    Results are cached per image content and parameters.
+    """
+    if reduce not in ('mean', 'extreme'):
+        raise ValueError("reduce must be 'mean' or 'extreme'.")
+    path = os.path.join(ASSET_PATH, filename)
+    cache_dir = cache_dir if cache_dir is not None else DIGITIZED_CACHE_PATH
+    parameters = (volts_per_division, seconds_per_division, tuple(divisions),
+        None if plot_box is None else tuple(plot_box),
+        None if trace_colour is None else tuple(trace_colour),
+        colour_tolerance, zero_offset_divisions, reduce, channel)
+    key = hashlib.sha1('{}|{}'.format(_file_digest(path), parameters).encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, key + '.npz')
+    if os.path.exists(cache_path):
+        os.utime(cache_path)
+        with np.load(cache_path) as data:
+            return Capture(data['times'], {channel: data['volts']})
+
+    image = np.asarray(Image.open(path).convert('RGB')).astype(np.int16)
+    left, top, right, bottom = plot_box if plot_box is not None else _find_plot_box(image)
+    # Inside the frame lines only, the UI around it uses the trace colour too
+    inner = image[top + 1:bottom, left + 1:right]
+    colour = np.asarray(trace_colour if trace_colour is not None else _dominant_trace_colour(inner))
+    mask = np.sqrt(((inner - colour)**2).sum(axis=2)) < colour_tolerance
+
+    zero_row = (bottom - top) / 2 - zero_offset_divisions * (bottom - top) / divisions[1]
+    rows = np.arange(1, bottom - top)[:, np.newaxis].astype(np.float64)
+    counts = mask.sum(axis=0)
+    found = counts > 0
+    if not found.any():
+        raise ValueError("No trace pixels found in '{}'.".format(path))
+    if reduce == 'mean':
+        trace_rows = (mask * rows).sum(axis=0) / np.maximum(counts, 1)
+    else:
+        highest = np.where(mask, rows, np.inf).min(axis=0)
+        lowest = np.where(mask, rows, -np.inf).max(axis=0)
+        trace_rows = np.where(np.abs(highest - zero_row) >= np.abs(lowest - zero_row), highest, lowest)
+    columns = np.arange(1, right - left, dtype=np.float64)
+    trace_rows = np.interp(columns, columns[found], trace_rows[found])
+
+    times = columns / (right - left) * divisions[0] * seconds_per_division
+    volts = (zero_row - trace_rows) / (bottom - top) * divisions[1] * volts_per_division
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez_compressed(cache_path, times=times, volts=volts)
+    _evict_lru(cache_dir, CAPTURE_CACHE_MAX_BYTES)
+    return Capture(times, {channel: volts})
+
+def _digitize_scope_image_job(args):
+    filename, kwargs = args
+    return digitize_scope_image(filename, **kwargs)
+
+def digitize_scope_images(filenames:Sequence, max_workers:int=None, **kwargs) -> dict:
+    """ Digitizes a batch of screenshots in parallel processes, returns {filename: Capture}. """
+    filenames = list(filenames)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        captures = executor.map(_digitize_scope_image_job, [(filename, kwargs) for filename in filenames])
+        return dict(zip(filenames, captures))
+
+
+class CallbackStats:
+    """ 
+    Opt-in instrumentation of the external source callbacks for one run:
+    call counts, time spent in Python and a histogram of the requested times.
+    """
+
+    def __init__(self, end_time:float, bins:int=100):
+        self.end_time = end_time
+        self.bins = bins
+        self.vsrc_calls = 0
+        self.isrc_calls = 0
+        self.seconds = 0.0
+        self.accepted_timesteps = None
+        # Plain list, incrementing Python ints is cheaper than NumPy scalars in the hot path
+        self._histogram = [0] * (bins + 1)
+        self._bins_per_second = bins / end_time
+
+    def record(self, time:float, elapsed:float):
+        self.seconds += elapsed
+        self._histogram[min(max(int(time * self._bins_per_second), 0), self.bins)] += 1
+
+    @property
+    def calls(self) -> int:
+        return self.vsrc_calls + self.isrc_calls
+
+    @property
+    def histogram(self) -> tuple:
+        """ (counts, bin edges) of the requested times, the last bin counts times past end_time. """
+        edges = np.linspace(0, self.end_time, self.bins + 1)
+        return np.array(self._histogram[:-1]), edges
+
+    def as_dict(self) -> dict:
+        counts, edges = self.histogram
+        return {
+            'vsrc_calls': self.vsrc_calls,
+            'isrc_calls': self.isrc_calls,
+            'seconds': self.seconds,
+            'accepted_timesteps': self.accepted_timesteps,
+            'calls_per_timestep': self.calls / self.accepted_timesteps if self.accepted_timesteps else None,
+            'seconds_per_call': self.seconds / self.calls if self.calls else None,
+            'histogram': counts.tolist(),
+            'histogram_edges': edges.tolist(),
+            'calls_past_end_time': self._histogram[-1],
+        }
+
+
+def _vector_key(name:str) -> str:
+    """ Normalised vector name, 'V(output)' and 'output' are the same node voltage. """
+    name = name.lower()
+    if name.startswith('v(') and name.endswith(')'):
+        name = name[2:-1]
+    return name
+
+class StreamingRecorder:
+    """ 
+    Collects the selected vectors of each accepted timepoint from ngspice's send_data callback
+    into preallocated (capacity, vectors) NumPy buffers, see stream_transient.
+    The callback only copies values into the current buffer; full buffers are queued and
+    handled by process_ready() in the main thread: passed to 'on_chunk(recorder, chunk)',
+    spilled to 'spill_directory' as '.npy' files and/or kept in memory ('keep').
+    With spilling or keep=False, peak memory is a few buffers whatever the run length.
+    stop_conditions are callables of the current row (values in 'vectors' order) returning True
+    to stop the run, e.g. ThresholdCrossings; they run in ngspice's thread, keep them cheap.
+    """
+
+    def __init__(
+            self, vectors:Sequence=('time', 'output'), capacity:int=1 << 16,
+            spill_directory:str=None, on_chunk=None, keep:bool=True, buffers:int=4,
+            stop_conditions:Sequence=()):
+        self.vectors = tuple(vectors)
+        self.stop_conditions = list(stop_conditions)
+        self.capacity = capacity
+        self.spill_directory = spill_directory
+        self.on_chunk = on_chunk
+        self.keep = keep
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+        self._free = queue.Queue()
+        for _ in range(buffers):
+            self._free.put(np.empty((capacity, len(self.vectors))))
+        self.reset()
+
+    def reset(self):
+        """ Forgets the recorded data, called before each run. """
+        # Hand the buffers of the previous run back
+        if getattr(self, '_buffer', None) is not None:
+            while not self._ready.empty():
+                self._free.put(self._ready.get_nowait())
+            self._free.put(self._buffer)
+        self._ready = queue.Queue()
+        self._keys = None
+        self._buffer = self._take_buffer()
+        self._index = 0
+        self.rows = 0
+        self.chunks = []  # arrays, or '.npy' paths when spilling
+        self.stop_reason = None
+        for condition in self.stop_conditions:
+            if hasattr(condition, 'bind'):
+                condition.bind(self.vectors)
+
+    def _take_buffer(self) -> np.ndarray:
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            # The main thread is behind, grow rather than block ngspice
+            return np.empty((self.capacity, len(self.vectors)))
+
+    def _resolve_keys(self, actual_vector_values:dict) -> list:
+        available = {_vector_key(name): name for name in actual_vector_values}
+        keys = [available.get(_vector_key(vector)) for vector in self.vectors]
+        missing = [vector for vector, key in zip(self.vectors, keys) if key is None]
+        if missing:
+            logger.warning('Vectors {} are not sent by ngspice (available: {}), recorded as NaN.'.format(
+                missing, sorted(actual_vector_values)))
+        return keys
+
+    def record(self, actual_vector_values:dict):
+        """ send_data hook: one accepted timepoint, {vector name: complex value}. """
+        if self._keys is None:
+            self._keys = self._resolve_keys(actual_vector_values)
+        row = self._buffer[self._index]
+        for column, key in enumerate(self._keys):
+            row[column] = actual_vector_values[key].real if key is not None else math.nan
+        if self.stop_conditions and self.stop_reason is None:
+            for condition in self.stop_conditions:
+                if condition(row):
+                    self.stop_reason = condition
+                    break
+        self._index += 1
+        if self._index == self.capacity:
+            self._ready.put(self._buffer)
+            self._buffer = self._take_buffer()
+            self._index = 0
+
+    def process_ready(self) -> int:
+        """ Handles the full buffers queued so far, returns how many. """
+        count = 0
+        while True:
             try:
-                num = float(line.strip())
-                numbers.append(num)
-            except ValueError:
-                pass
-    return numbers
-    
+                buffer = self._ready.get_nowait()
+            except queue.Empty:
+                return count
+            self._process(buffer)
+            self._free.put(buffer)
+            count += 1
+
+    def _process(self, chunk:np.ndarray):
+        self.rows += len(chunk)
+        if self.on_chunk is not None:
+            self.on_chunk(self, chunk)
+        if not self.keep:
+            return
+        if self.spill_directory is not None:
+            path = os.path.join(self.spill_directory, 'chunk_{:06d}.npy'.format(len(self.chunks)))
+            np.save(path, chunk)
+            self.chunks.append(path)
+        else:
+            self.chunks.append(chunk.copy())
+
+    def finish(self):
+        """ Handles the queued buffers and the partly filled one, called once the run is over. """
+        self.process_ready()
+        if self._index:
+            self._process(self._buffer[:self._index])
+            self._index = 0
+
+    def data(self) -> np.ndarray:
+        """ Kept rows as one (rows, vectors) array, spilled chunks are memory-mapped while concatenating. """
+        if not self.chunks:
+            return np.empty((0, len(self.vectors)))
+        return np.concatenate([np.load(chunk, mmap_mode='r') if isinstance(chunk, str) else chunk
+            for chunk in self.chunks])
+
+    def __getitem__(self, vector:str) -> np.ndarray:
+        return self.data()[:, self.vectors.index(vector)]
+
+    def to_analysis(self) -> TransientAnalysis:
+        """ Kept rows as a TransientAnalysis, requires 'time' among the vectors. """
+        data = self.data()
+        arrays = {'time': data[:, self.vectors.index('time')]}
+        for column, vector in enumerate(self.vectors):
+            if vector == 'time':
+                continue
+            key = _vector_key(vector)
+            if key.endswith('#branch'):
+                arrays['branch:' + key[:-len('#branch')]] = data[:, column]
+            else:
+                arrays['node:' + key] = data[:, column]
+        time_waveform = _arrays_to_waveforms('', {'time': arrays.pop('time')})[0]
+        return TransientAnalysis(time=time_waveform, simulation=None,
+            nodes=_arrays_to_waveforms('node:', arrays, time_waveform),
+            branches=_arrays_to_waveforms('branch:', arrays, time_waveform), internal_parameters=[])
+
+
+class ThresholdCrossings:
+    """ 
+    Stop condition: 'count' crossings of 'threshold' by 'vector', counting 'rising', 'falling'
+    or 'both' edges. 'hysteresis' (V) ignores noise around the threshold.
+    """
+
+    DIRECTIONS = ('rising', 'falling', 'both')
+
+    def __init__(
+            self, vector:str='output', threshold:float=0.5, count:int=1,
+            direction:str='rising', hysteresis:float=0):
+        if direction not in self.DIRECTIONS:
+            raise ValueError("direction '{}' is not one of {}.".format(direction, self.DIRECTIONS))
+        self.vector = vector
+        self.threshold = threshold
+        self.count = count
+        self.direction = direction
+        self.hysteresis = hysteresis
+        self._column = None
+        self.reset()
+
+    def reset(self):
+        self.crossings = 0
+        self._high = None
+
+    def bind(self, vectors:Sequence):
+        """ Finds the column of 'vector' in the recorded vectors and resets the count. """
+        keys = [_vector_key(vector) for vector in vectors]
+        if _vector_key(self.vector) not in keys:
+            raise ValueError("vector '{}' is not recorded, add it to the recorder's vectors.".format(self.vector))
+        self._column = keys.index(_vector_key(self.vector))
+        self.reset()
+
+    def __call__(self, row) -> bool:
+        value = row[self._column]
+        if self._high is None:
+            self._high = value > self.threshold
+        elif not self._high and value > self.threshold + self.hysteresis / 2:
+            self._high = True
+            if self.direction != 'falling':
+                self.crossings += 1
+        elif self._high and value < self.threshold - self.hysteresis / 2:
+            self._high = False
+            if self.direction != 'rising':
+                self.crossings += 1
+        return self.crossings >= self.count
+
+    def __repr__(self):
+        return '{}({!r}, {}, count={}, direction={!r})'.format(
+            type(self).__name__, self.vector, self.threshold, self.count, self.direction)
+
 
 class MyNgSpiceShared(NgSpiceShared):
 
 
     def __init__(
-            self, voltages:Sequence=None, step_time=None, end_time:float=1.0,
-            default_voltage=0, **kwargs):
+            self, voltages:Sequence=None, step_time=None, end_time:float=None,
+            default_voltage=0, interpolation:str='linear', times:Sequence=None,
+            voltage_source=None, voltage_sources:dict=None, current_sources:dict=None,
+            default_current=0, instrument:bool=False, stats_path:str=None, **kwargs):
+        """ 
+        voltages/times/voltage_source define the waveform served to every external voltage source.
+        voltage_sources/current_sources map external source names (as given to circuit.V / circuit.I)
+        to their own waveform engine, any callable of time, e.g. a WaveformSource.
+        instrument: collect CallbackStats for each run, kept in 'callback_stats_history'
+        and appended as a JSON line to 'stats_path' when given.
+        Pass send_data=True to stream results into a StreamingRecorder, see stream_transient.
+        """
         super().__init__(**kwargs)
 
-        # Ternary Operators
-        self.voltages = voltages if isinstance(voltages, Sequence) \
-            else read_num_from_text_file()
-        self.end_time = end_time
-        self.step_time = step_time if isinstance(step_time, numbers.Number) \
-            else self.end_time / len(self.voltages)
         self.default_voltage = default_voltage
+        self.default_current = default_current
+        self.set_waveform(voltages, step_time=step_time, end_time=end_time,
+            interpolation=interpolation, times=times, voltage_source=voltage_source)
+        self.set_sources(voltage_sources, current_sources)
+        self.recorder = None
+
+        # Pick the callbacks once, the plain ones neither log nor count
+        self.instrument = instrument
+        self.stats_path = stats_path
+        self.callback_stats = None
+        self.callback_stats_history = []
+        self._log_callbacks = self._logger.isEnabledFor(logging.DEBUG)
+        if instrument or self._log_callbacks:
+            self.get_vsrc_data = self._get_vsrc_data_traced
+            self.get_isrc_data = self._get_isrc_data_traced
+
+    def set_waveform(
+            self, voltages:Sequence=None, step_time=None, end_time:float=None,
+            interpolation:str='linear', times:Sequence=None, voltage_source=None):
+        """ 
+        (Re)defines the waveform served to every external voltage source, see __init__.
+        Forgets the sources resolved by earlier runs, so a pooled instance can be retargeted per job.
+        """
+        self._vsrc_resolved = dict()
+        # Looked up by simulation time, ngspice may call several times per timestep
+        if voltage_source is not None:
+            # Any callable of time, e.g. a SocketWaveformSource
+            self.voltages = None
+            self.step_time = step_time
+            self.end_time = end_time if end_time is not None else 1.0
+            self.voltage_source = voltage_source
+        elif isinstance(voltages, Iterator):
+            # Lazy samples or sample blocks, only a bounded window is buffered
+            if not isinstance(step_time, numbers.Number):
+                raise ValueError("step_time is required when voltages is an iterator.")
+            self.voltages = None
+            self.step_time = step_time
+            self.end_time = end_time if end_time is not None else 1.0
+            self.voltage_source = StreamingWaveformSource(voltages, self.step_time,
+                interpolation=interpolation, default_value=self.default_voltage)
+        else:
+            self.voltages = _default_voltages(voltages)
+            if times is not None:
+                # Real timebase, step and end time come from the data
+                self.voltage_source = WaveformSource(times, self.voltages,
+                    interpolation=interpolation, default_value=self.default_voltage)
+                self.end_time = end_time if end_time is not None else self.voltage_source.end_time
+                self.step_time = step_time if isinstance(step_time, numbers.Number) \
+                    else float(np.median(np.diff(self.voltage_source.times)))
+            else:
+                self.end_time = end_time if end_time is not None else 1.0
+                self.step_time = step_time if isinstance(step_time, numbers.Number) \
+                    else self.end_time / len(self.voltages)
+                self.voltage_source = WaveformSource.from_samples(
+                    self.voltages, self.step_time,
+                    interpolation=interpolation, default_value=self.default_voltage)
+
+    def set_sources(self, voltage_sources:dict=None, current_sources:dict=None):
+        """ (Re)defines the per-name external source engines, see __init__. """
+        # Dispatch tables keyed by the ngspice instance name, e.g. 'vinput'
+        self._vsrc_table = {'v' + name.lower(): source for name, source in (voltage_sources or {}).items()}
+        self._isrc_table = {'i' + name.lower(): source for name, source in (current_sources or {}).items()}
+        # Per 'node' string resolution of the callbacks, including the defaults
+        self._vsrc_resolved = dict()
+        self._isrc_resolved = dict()
+
+    def _resolve_source(self, table:dict, resolved:dict, node:str, default):
+        """ 
+        First call for an unknown 'node' string: match it case-insensitively in the dispatch table
+        and remember the result in 'resolved', so later calls are a single dict lookup.
+        """
+        source = table.get(node.lower(), default)
+        resolved[node] = source
+        return source
+
+    @classmethod
+    def from_socket(
+            cls, address, sample_rate:float, end_time:float, back_pressure:str='hold',
+            capacity:int=1 << 20, **kwargs):
+        """ 
+        Live replay: samples streamed from a local socket (see serve_samples / sensor_producer.py).
+        The source's underrun counters are on 'voltage_source'.
+        """
+        source_kwargs = {key: kwargs.pop(key) for key in ('interpolation', 'block_timeout', 'dtype', 'history')
+            if key in kwargs}
+        voltage_source = SocketWaveformSource(address, sample_rate, capacity=capacity,
+            back_pressure=back_pressure, default_value=kwargs.get('default_voltage', 0), **source_kwargs)
+        return cls(voltage_source=voltage_source, step_time=kwargs.pop('step_time', 1 / sample_rate),
+            end_time=end_time, **kwargs)
+
+    @classmethod
+    def from_capture(
+            cls, capture:Capture, channel:str=None, sample_rate:float=None,
+            bandwidth:float=None, **kwargs):
+        """ 
+        Replays one channel of a scope capture on its own timebase.
+        Give 'sample_rate' (and optionally 'bandwidth') to resample it first,
+        the simulation step then follows the new rate instead of the raw one.
+        """
+        channel = channel if channel is not None else capture.channel_names[0]
+        if sample_rate is not None:
+            capture = resample_capture(
+                Capture(capture.times, {channel: capture[channel]}), sample_rate, bandwidth=bandwidth)
+        return cls(voltages=capture[channel], times=capture.times, **kwargs)
 
-        # Preping for callback function
-        self.callback_voltages = self.voltages.copy()
-        self.callback_voltages.reverse()
-
-    
     def get_vsrc_data(self, voltage, time, node, ngspice_id):
-        self._logger.debug('ngspice_id-{} get_vsrc_data @{} node {}'.format(ngspice_id, time, node))
-        # voltage[0] = self.__voltages[0]
+        # Hot path: called several times per timestep, keep it to a lookup and a call
         # voltage[0] = 10@u_V * math.sin(50@u_Hz.pulsation * time)
-        try:
-            volt = self.callback_voltages.pop()
-            voltage[0] = volt
-        except IndexError:
-            # If I used up the voltage inputs, use '0' by default.
-            voltage[0] = self.default_voltage
+        source = self._vsrc_resolved.get(node)
+        if source is None:
+            source = self._resolve_source(self._vsrc_table, self._vsrc_resolved, node, self.voltage_source)
+        voltage[0] = source(time)
         return 0
 
     def get_isrc_data(self, current, time, node, ngspice_id):
-        print(current, time, node, ngspice_id)
-        self._logger.debug('ngspice_id-{} get_isrc_data @{} node {}'.format(ngspice_id, time, node))
-        current[0] = 1
+        source = self._isrc_resolved.get(node)
+        if source is None:
+            source = self._resolve_source(self._isrc_table, self._isrc_resolved, node, self._default_current_source)
+        current[0] = source(time)
+        return 0
+
+    def _get_vsrc_data_traced(self, voltage, time, node, ngspice_id):
+        """ get_vsrc_data with debug logging and/or instrumentation. """
+        start = perf_counter()
+        MyNgSpiceShared.get_vsrc_data(self, voltage, time, node, ngspice_id)
+        if self.callback_stats is not None:
+            self.callback_stats.vsrc_calls += 1
+            self.callback_stats.record(time, perf_counter() - start)
+        if self._log_callbacks:
+            self._logger.debug('ngspice_id-%s get_vsrc_data @%s node %s = %s', ngspice_id, time, node, voltage[0])
+        return 0
+
+    def _get_isrc_data_traced(self, current, time, node, ngspice_id):
+        """ get_isrc_data with debug logging and/or instrumentation. """
+        start = perf_counter()
+        MyNgSpiceShared.get_isrc_data(self, current, time, node, ngspice_id)
+        if self.callback_stats is not None:
+            self.callback_stats.isrc_calls += 1
+            self.callback_stats.record(time, perf_counter() - start)
+        if self._log_callbacks:
+            self._logger.debug('ngspice_id-%s get_isrc_data @%s node %s = %s', ngspice_id, time, node, current[0])
         return 0
 
+    def send_data(self, actual_vector_values, number_of_vectors, ngspice_id):
+        if self.recorder is not None:
+            self.recorder.record(actual_vector_values)
+        return 0
+
+    @property
+    def is_running(self) -> bool:
+        """ 
+        True while ngspice's background thread runs, asked from ngspice itself: the argument of
+        its BGThreadRunning callback means 'not running', and PySpice stores it unchanged.
+        """
+        return bool(self._ngspice_shared.ngSpice_running())
+
+    @property
+    def sends_data(self) -> bool:
+        """ True when created with send_data=True, i.e. send_data is called for each timepoint. """
+        return self._send_data_c is not ffi.NULL
+
+    def run(self, background=False):
+        """ Runs the simulation, collecting CallbackStats when instrumented. """
+        if self.instrument:
+            self.callback_stats = CallbackStats(self.end_time)
+        super().run(background=background)
+        if self.instrument and not background:
+            self.export_callback_stats()
+
+    def _accepted_timesteps(self) -> int:
+        """ Length of the last plot's time vector, None for analyses without one. """
+        name = '{}.time'.format(self.last_plot).encode('utf8')
+        vector_info = self._ngspice_shared.ngGet_Vec_Info(name)
+        if vector_info == ffi.NULL:
+            return None
+        return vector_info.v_length
+
+    def export_callback_stats(self) -> dict:
+        """ Finalizes the stats of the last run: logs them, keeps them and writes them to stats_path. """
+        if self.callback_stats is None:
+            return None
+        self.callback_stats.accepted_timesteps = self._accepted_timesteps()
+        stats = self.callback_stats.as_dict()
+        self.callback_stats_history.append(stats)
+        self._logger.info('callbacks: {} vsrc, {} isrc, {:.3f} s in Python, {} calls per timestep'.format(
+            stats['vsrc_calls'], stats['isrc_calls'], stats['seconds'], stats['calls_per_timestep']))
+        if self.stats_path is not None:
+            with open(self.stats_path, 'a') as file:
+                file.write(json.dumps(stats) + os.linesep)
+        return stats
+
+    def _default_current_source(self, time):
+        return self.default_current
+
+def prepare_ngspice_libraries(count:int, library_path:str=None, directory:str=None) -> str:
+    """ 
+    ngspice keeps global state, so parallel instances need their own copy of the shared library:
+    PySpice loads 'libngspice{id}.so' for ngspice_id > 0. Copies the library to 'directory'
+    for ids 0..count-1 and points NgSpiceShared.LIBRARY_PATH there. Returns the directory.
+    """
+    template = NgSpiceShared.LIBRARY_PATH
+    source = library_path if library_path is not None else template.format('')
+    name = os.path.basename(template.format(''))
+    candidates = [source] + [os.path.join(path, name) for path in
+        ('/usr/local/lib', '/usr/lib', '/usr/lib64', '/usr/lib/x86_64-linux-gnu', '/opt/homebrew/lib')]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            source = candidate
+            break
+    else:
+        raise FileNotFoundError("ngspice library '{}' not found, pass library_path.".format(source))
+    directory = directory if directory is not None else tempfile.mkdtemp(prefix='ngspice-')
+    for ngspice_id in range(count):
+        target = os.path.join(directory, os.path.basename(template.format(ngspice_id or '')))
+        if not os.path.exists(target):
+            shutil.copy2(source, target)
+    NgSpiceShared.LIBRARY_PATH = os.path.join(directory, os.path.basename(template))
+    return directory
+
+def _process_rss() -> int:
+    """ Resident memory of this process in bytes (ngspice runs in-process). """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class NgSpicePool:
+    """ 
+    Pool of pre-initialised ngspice instances with distinct ngspice_ids.
+    Borrow one with 'with pool.borrow() as ngspice_shared:', it is reset (remcirc, destroy all)
+    when returned. Instances are recycled after a failed job or health check, after 'max_jobs'
+    jobs, or when the process grew by more than 'max_memory_growth' bytes since their creation,
+    by reloading their library, see _recycle.
+    """
+
+    _logger = logger.getChild('NgSpicePool')
+
+    def __init__(
+            self, size:int=1, factory=MyNgSpiceShared, first_id:int=0, max_jobs:int=1000,
+            max_memory_growth:int=512 << 20, copy_library:bool=None, **factory_kwargs):
+        if copy_library is None:
+            copy_library = first_id + size > 1
+        if copy_library:
+            prepare_ngspice_libraries(first_id + size)
+        if issubclass(factory, MyNgSpiceShared) and 'voltages' not in factory_kwargs \
+                and 'voltage_source' not in factory_kwargs:
+            # Jobs set their own waveform, see MyNgSpiceShared.set_waveform
+            factory_kwargs['voltages'] = np.zeros(1)
+        self.factory = factory
+        self.factory_kwargs = factory_kwargs
+        self.max_jobs = max_jobs
+        self.max_memory_growth = max_memory_growth
+        self.recycled = 0
+        self._records = dict()  # id(instance): [ngspice_id, jobs, rss at creation]
+        self._idle = queue.Queue()
+        for ngspice_id in range(first_id, first_id + size):
+            self._idle.put(self._create(ngspice_id))
+
+    def _create(self, ngspice_id:int):
+        instance = self.factory(ngspice_id=ngspice_id, **self.factory_kwargs)
+        self._records[id(instance)] = [ngspice_id, 0, _process_rss()]
+        return instance
+
+    def _reset(self, instance) -> bool:
+        """ Clears circuits and plots, then checks the instance still answers commands. """
+        try:
+            instance.remove_circuit()
+            instance.destroy('all')
+            instance.exec_command('echo ok')
+        except Exception:
+            return False
+        if isinstance(instance, MyNgSpiceShared):
+            instance.set_sources()
+        return True
+
+    def _is_healthy(self, instance) -> bool:
+        _, jobs, rss = self._records[id(instance)]
+        return jobs < self.max_jobs and _process_rss() - rss <= self.max_memory_growth
+
+    def _recycle(self, instance):
+        """ 
+        Replaces 'instance' by a new one with the same ngspice_id. After 'quit' ngspice has to be
+        unloaded before it is loaded again, so the library handle is closed first. dlclose is only
+        a request: if the library stays mapped (another handle on the same file, e.g. without
+        copy_library), the new instance inherits its global state and a crashed engine stays broken.
+        """
+        ngspice_id, _, _ = self._records.pop(id(instance))
+        self._logger.info('Recycling ngspice instance {}'.format(ngspice_id))
+        try:
+            instance.quit()
+        except Exception:
+            pass
+        try:
+            ffi.dlclose(instance._ngspice_shared)
+        except Exception as exception:
+            self._logger.warning('Could not unload the library of ngspice instance {}: {}'.format(
+                ngspice_id, exception))
+        self.recycled += 1
+        return self._create(ngspice_id)
+
+    @contextlib.contextmanager
+    def borrow(self, timeout:float=None):
+        """ Context manager lending an idle instance, waits up to 'timeout' seconds for one. """
+        instance = self._idle.get(timeout=timeout)
+        self._records[id(instance)][1] += 1
+        failed = True
+        try:
+            yield instance
+            failed = False
+        finally:
+            if failed or not self._reset(instance) or not self._is_healthy(instance):
+                # The old instance is gone either way, if no replacement can be created
+                # the slot is dropped and the error propagates
+                instance = self._recycle(instance)
+            self._idle.put(instance)
+
+    def close(self):
+        """ Quits every idle instance. """
+        while True:
+            try:
+                instance = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                instance.quit()
+            except Exception:
+                pass
+
+_ngspice_pool = None
+
+def get_ngspice_pool() -> NgSpicePool:
+    """ Module-wide pool used by the circuit functions below, one warm instance. """
+    global _ngspice_pool
+    if _ngspice_pool is None:
+        _ngspice_pool = NgSpicePool(size=1)
+    return _ngspice_pool
+
+def _start_background_transient(simulator, step_time, end_time, **kwargs):
+    """ simulator.transient(...) up to the run, which is started in ngspice's background thread. """
+    ngspice_shared = simulator.ngspice
+    simulator.reset_analysis()
+    CircuitSimulation.transient(simulator, step_time, end_time, **kwargs)
+    ngspice_shared.destroy()
+    ngspice_shared.load_circuit(str(simulator))
+    simulator.reset_analysis()
+    ngspice_shared.run(background=True)
+
+def _background_analysis(simulator):
+    """ Analysis of the last plot, as simulator.transient(...) returns it. """
+    plot_name = simulator.ngspice.last_plot
+    if plot_name == 'const':
+        raise NameError('Simulation failed')
+    return simulator.ngspice.plot(simulator, plot_name).to_analysis()
+
+def stream_transient(
+        simulator, step_time, end_time, recorder:StreamingRecorder=None,
+        poll_interval:float=10e-3, save_vectors:bool=True, time_limit:float=None,
+        **kwargs) -> StreamingRecorder:
+    """ 
+    Transient analysis streamed through send_data: ngspice runs in its background thread and
+    the recorder's full buffers are processed (on_chunk, spill) here while it runs.
+    The simulator's MyNgSpiceShared must be created with send_data=True.
+    save_vectors: '.save' only the recorded vectors, so ngspice keeps no others in memory.
+    The run is halted (bg_halt) once one of the recorder's stop_conditions is met or after
+    'time_limit' seconds of wall-clock time, recorder.stop_reason tells which.
+    Returns the recorder, see StreamingRecorder.data / to_analysis.
+    """
+    ngspice_shared = simulator.ngspice
+    if not isinstance(ngspice_shared, MyNgSpiceShared) or not ngspice_shared.sends_data:
+        raise ValueError("stream_transient needs a MyNgSpiceShared created with send_data=True.")
+    recorder = recorder if recorder is not None else StreamingRecorder()
+    if save_vectors:
+        simulator.save([vector for vector in recorder.vectors if vector != 'time'])
+
+    recorder.reset()
+    ngspice_shared.recorder = recorder
+    try:
+        start = perf_counter()
+        _start_background_transient(simulator, step_time, end_time, **kwargs)
+        halted = False
+        while ngspice_shared.is_running:
+            recorder.process_ready()
+            if not halted:
+                # ngspice commands cannot be sent from its own thread, so the callback
+                # only flags the stop and it is acted on here
+                if recorder.stop_reason is None and time_limit is not None \
+                        and perf_counter() - start > time_limit:
+                    recorder.stop_reason = 'time_limit'
+                if recorder.stop_reason is not None:
+                    ngspice_shared.halt()
+                    halted = True
+            time.sleep(poll_interval)
+    finally:
+        ngspice_shared.recorder = None
+    recorder.finish()
+    return recorder
+
+def transient_until(
+        simulator, step_time, end_time, stop_conditions:Sequence=(), time_limit:float=None,
+        recorder:StreamingRecorder=None, **kwargs):
+    """ 
+    simulator.transient(...) that stops early, e.g. after the first N trigger edges:
+        transient_until(simulator, 1e-6, 2, [ThresholdCrossings('output', 0.5, count=4)])
+    stop_conditions are evaluated on each streamed timepoint, see StreamingRecorder.
+    Returns the (partial) analysis, its 'stop_reason' attribute is None for a complete run.
+    """
+    if recorder is None:
+        vectors = ['time'] + [condition.vector for condition in stop_conditions
+            if getattr(condition, 'vector', None) is not None]
+        recorder = StreamingRecorder(vectors=list(dict.fromkeys(vectors)), capacity=1 << 12, keep=False)
+    recorder.stop_conditions = list(stop_conditions)
+    stream_transient(simulator, step_time, end_time, recorder=recorder,
+        save_vectors=False, time_limit=time_limit, **kwargs)
+    analysis = _background_analysis(simulator)
+    analysis.stop_reason = recorder.stop_reason
+    return analysis
+
+# How a recorded waveform is handed to ngspice
+SOURCE_MODES = ('callback', 'pwl', 'filesource')
+
+
+def _format_pwl_points(times, values, pairs_per_line:int=8) -> str:
+    """ Formats time/value pairs as PWL continuation lines, in bulk with NumPy. """
+    pairs = np.column_stack((times, values)).ravel()
+    n_full = pairs.size // (2*pairs_per_line) * (2*pairs_per_line)
+    buffer = io.StringIO()
+    if n_full:
+        np.savetxt(buffer, pairs[:n_full].reshape(-1, 2*pairs_per_line), fmt='%.9g', newline='\n+ ')
+    if n_full < pairs.size:
+        np.savetxt(buffer, pairs[n_full:].reshape(1, -1), fmt='%.9g', newline='\n+ ')
+    return buffer.getvalue()
+
+def _add_waveform_source(
+        circuit:Circuit, element:str, name:str, positive, negative, source:WaveformSource,
+        mode:str, directory:str):
+    """ Shared by add_waveform_voltage_source and add_waveform_current_source, element is 'V' or 'I'. """
+    if mode not in SOURCE_MODES:
+        raise ValueError("mode '{}' is not one of {}.".format(mode, SOURCE_MODES))
+    if mode == 'callback':
+        return getattr(circuit, element)(name, positive, negative, 'dc 0 external')
+    if not isinstance(source, WaveformSource):
+        raise TypeError("mode '{}' needs a WaveformSource, not {}.".format(mode, type(source)))
+
+    positive, negative = str(positive), str(negative)
+    if mode == 'pwl':
+        if source.interpolation != 'linear':
+            raise ValueError("PWL sources only interpolate linearly, use mode 'filesource' instead.")
+        spice = '{}{} {} {} PWL(\n+ {})'.format(
+            element, name, positive, negative, _format_pwl_points(source.times, source.values))
+    else:
+        directory = directory if directory is not None else tempfile.mkdtemp(prefix='pyspice-')
+        path = os.path.join(directory, '{}{}.txt'.format(element, name))
+        np.savetxt(path, np.column_stack((source.times, source.values)), fmt='%.9g')
+        model = 'filesrc_{}{}'.format(element, name)
+        port = '%vd' if element == 'V' else '%id'
+        amplstep = 'true' if source.interpolation == 'hold' else 'false'
+        spice = (
+            'A{}{} {}([{} {}]) {}\n'.format(element, name, port, positive, negative, model) +
+            '.model {} filesource (file="{}" amploffset=[0] amplscale=[1] '.format(model, path) +
+            'timeoffset=0 timescale=1 timerelative=false amplstep={})'.format(amplstep)
+            )
+    circuit.raw_spice += spice + os.linesep
+    return spice
+
+def add_waveform_voltage_source(
+        circuit:Circuit, name:str, positive, negative, source:WaveformSource=None,
+        mode:str='callback', directory:str=None):
+    """ 
+    Adds a voltage source driven by a recorded waveform.
+    mode:
+    - 'callback': external source, served by MyNgSpiceShared.get_vsrc_data
+    - 'pwl': ngspice native PWL source, written into the netlist
+    - 'filesource': XSPICE filesource reading a data file written once to 'directory'
+    Native modes run the whole transient without Python callbacks.
+    """
+    return _add_waveform_source(circuit, 'V', name, positive, negative, source, mode, directory)
+
+def add_waveform_current_source(
+        circuit:Circuit, name:str, positive, negative, source:WaveformSource=None,
+        mode:str='callback', directory:str=None):
+    """ Same as add_waveform_voltage_source for a current source, served by get_isrc_data. """
+    return _add_waveform_source(circuit, 'I', name, positive, negative, source, mode, directory)
+
 class ParallelResistors(SubCircuitFactory):
     NAME = "ParallelResistors"
     NODES = ('n1', 'n2',)
@@ -124,28 +1739,73 @@ class Rectifier(SubCircuitFactory):
         self.X('D4', diode_model, 'input_2', 'output_1')
 
 
+class SortedLookup:
+    """ 
+    Lookup table built once from (key, value) pairs: keys are sorted and queried with
+    np.searchsorted, whole arrays of queries at once.
+    mode 'nearest' returns the value of the closest key (the lower one on ties),
+    'linear' interpolates numeric values between keys, clamped at the ends.
+    """
+
+    MODES = ('nearest', 'linear')
+
+    def __init__(self, keys:Sequence, values:Sequence, mode:str='nearest'):
+        if mode not in self.MODES:
+            raise ValueError("mode '{}' is not one of {}.".format(mode, self.MODES))
+        keys = np.asarray(keys, dtype=np.float64)
+        values = np.asarray(values)
+        if keys.shape != values.shape[:1] or not len(keys):
+            raise ValueError("keys and values must be non-empty and of the same length.")
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.values = values[order]
+        self.mode = mode
+
+    @classmethod
+    def from_dict(cls, table:dict, mode:str='nearest'):
+        """ Keeps the dict's values as they are (lists, ints, ...), 'nearest' hands them back unchanged. """
+        # Element-wise, so equal-length lists do not turn into a 2-D array
+        values = np.empty(len(table), dtype=object)
+        for i, value in enumerate(table.values()):
+            values[i] = value
+        return cls(np.fromiter(table.keys(), dtype=np.float64, count=len(table)), values, mode=mode)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def nearest_index(self, queries) -> np.ndarray:
+        """ Index (in sorted order) of the closest key to each query. """
+        queries = np.asarray(queries, dtype=np.float64)
+        upper = np.clip(np.searchsorted(self.keys, queries), 1, max(len(self.keys) - 1, 1))
+        lower = upper - 1
+        if len(self.keys) == 1:
+            return np.zeros(queries.shape, dtype=np.intp)
+        return np.where(queries - self.keys[lower] <= self.keys[upper] - queries, lower, upper)
+
+    def __call__(self, queries, mode:str=None):
+        """ Values for 'queries' (a number or an array), a number for a number. """
+        mode = mode if mode is not None else self.mode
+        if mode == 'linear':
+            result = np.interp(queries, self.keys, np.asarray(self.values, dtype=np.float64))
+        elif mode == 'nearest':
+            result = self.values[self.nearest_index(queries)]
+        else:
+            raise ValueError("mode '{}' is not one of {}.".format(mode, self.MODES))
+        return result[()] if isinstance(result, np.ndarray) and result.ndim == 0 else result
+
 def closest_input_for_output(dict1:dict, key)->'dict1[key]':
-    """ Returns the value corresponding to the best matching key. """
+    """ 
+    Returns the value corresponding to the best matching key.
+    For repeated or array queries build a SortedLookup once instead.
+    """
     assert isinstance(dict1, dict), "dict1 is not of type 'dictionary'."
     # Checks
     if dict1 == dict():
         return None
-    # Setting default values to compare with
-    best_key = list(dict1.keys())[0]
-    best_value, best_score = dict1[best_key], None
-    if isinstance(key, numbers.Number):
-        assert all((isinstance(k,numbers.Number) for k in dict1.keys()))
-        if best_score is None:
-            best_score = abs(best_key - key)
-        for k,v in dict1.items():
-            # The closer the key and value's key, the better the score
-            if abs(k - key) < best_score:
-                best_value = v
-            # Best possible answer
-            if best_score == 0: break
-    else:
+    if not isinstance(key, numbers.Number):
         raise TypeError("type '{}' is not supported for the function 'closest_input_for_output'.".format(type(key)))
-    return best_value
+    assert all((isinstance(k,numbers.Number) for k in dict1.keys()))
+    return SortedLookup.from_dict(dict1)(key)
 
 def what_is_unit():
     option = 1
@@ -187,8 +1847,10 @@ def circuit1():
     circuit.R(2, 'output', circuit.gnd, 1@u_kOhm)
 
     # DC operating point analysis
-    simulator = circuit.simulator(temperature=25, nominal_temperature=25)
-    analysis = simulator.operating_point()
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        analysis = simulator.operating_point()
 
     print(circuit)
 
@@ -204,8 +1866,10 @@ def parallel_resistor_circuit():
     circuit.V(1, 1, circuit.gnd, 5@u_V)
     print(circuit)
 
-    simulator = circuit.simulator(temperature=25, nominal_temperature=25)
-    analysis = simulator.operating_point()
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        analysis = simulator.operating_point()
 
     print_nodes(analysis)
 
@@ -220,8 +1884,10 @@ def raw_spice_circuit():
     circuit.raw_spice = text
     # circuit.R(2, 'out', 0, raw_spice='1k')
 
-    simulator = circuit.simulator(temperature=25, nominal_temperature=25)
-    analysis = simulator.operating_point()
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        analysis = simulator.operating_point()
     print_nodes(analysis)
 
     print(circuit)
@@ -243,30 +1909,28 @@ def engine_pickup_sensor_circuit():
 
     # circuit.V('input', 'input', circuit.gnd, 'dc 0 external')
     circuit.V('input', 'input', circuit.gnd, 14.4@u_V)
-    circuit.R(1, 'in', 'out', 700@u_Ohm)
+    circuit.R(1, 'input', 'out', 700@u_Ohm)
     circuit.X('D1', '1N4148', 'out', circuit.gnd)
     print(circuit)
 
-    simulator = circuit.simulator()
-    voltages = read_num_from_text_file()
+    voltages = load_cached_num_array_from_text_file()
 
-    # STOPPED HERE
-    slice1 = slice(0, max(voltages), 1e-3)
-    analysis = simulator.dc(Vinput=slice1)
+    slice1 = slice(float(voltages.min()), float(voltages.max()), 1e-3)
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        simulator = circuit.simulator(simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        analysis = simulator.dc(Vinput=slice1)
 
     n_voltages = len(voltages)
     times = np.linspace(0, 10*0.05, num=n_voltages)
-    if False:
-        t_input_voltage_pair = dict()
-        for i in range(n_voltages):
-            t_input_voltage_pair.update({times[i]:voltages[i]})
-        # output_voltages = [closest_input_for_output(dict1, analysis.out[t]) for t in times]
+    # Quasi-static replay: the whole input through the DC curve at once
+    output_voltages = TransferCurve.from_analysis(analysis, 'out')(voltages)
     
     figure, axis = plt.subplots(1,1)
-    # axis.plot(t, voltages, t, analysis.Vinput)
-    # axis.plot(times, voltages, times, output_voltages)
+    axis.plot(times, voltages, times, output_voltages)
     
-    analysis = simulator.transient(step_time=1@u_us, end_time=2@u_s)
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        simulator = circuit.simulator(simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        analysis = simulator.transient(step_time=1@u_us, end_time=2@u_s)
     axis.plot(times, voltages, times, analysis.out)
 
 
@@ -279,9 +1943,36 @@ def engine_pickup_sensor_circuit():
     # print(diode, 'diode')
     # circuit.include(diode)
 
-def engine_pickup_sensor_circuit_2():
+# Production conditioning circuit defaults
+PICKUP_LOAD_RESISTANCE = 700@u_Ohm
+PICKUP_DIODE_PARAMETERS = dict(IS=4.352@u_uA, RS=0.6458@u_Ohm, BV=110@u_V, IBV=0.0001@u_V, N=1.906)
+
+def pickup_sensor_circuit(
+        source:WaveformSource=None, source_mode:str='callback', directory:str=None,
+        load_resistance=PICKUP_LOAD_RESISTANCE, diode_parameters:dict=None) -> Circuit:
+    """ 
+    R1 (700 Ohm) and 1N4148PH diode, driven by a recorded waveform on node 'input'.
+    source_mode 'dc' makes Vinput a plain 0 V source instead, for DC sweeps.
+    diode_parameters override entries of PICKUP_DIODE_PARAMETERS.
+    """
+    circuit = Circuit("Rectify External Voltage")
+
+    if source_mode == 'dc':
+        circuit.V('input', 'input', circuit.gnd, 0@u_V)
+    else:
+        add_waveform_voltage_source(circuit, 'input', 'input', circuit.gnd,
+            source=source, mode=source_mode, directory=directory)
+    circuit.R(1, 'input', 'output', load_resistance)
+    circuit.model('1N4148PH', 'D', **dict(PICKUP_DIODE_PARAMETERS, **(diode_parameters or {})))
+    circuit.Diode(1, 'output', circuit.gnd, model="1N4148PH")
+    # circuit.X('D1', '1N4148', 'output', circuit.gnd)
+    # circuit.R(2, 'output', circuit.gnd, 700@u_Ohm)
+    return circuit
+
+def engine_pickup_sensor_circuit_2(source_mode:str='callback'):
     """ 
         Use Transient method to simulate circuit.
+        source_mode selects how the input waveform reaches ngspice, see SOURCE_MODES.
 
         References:
         - most important: 
@@ -290,30 +1981,25 @@ def engine_pickup_sensor_circuit_2():
             https://pyspice.fabrice-salvaire.fr/releases/v1.5/examples/diode/diode-characteristic-curve.html#simulation
             https://pyspice.fabrice-salvaire.fr/releases/v1.5/api/PySpice/Spice/Simulation.html#PySpice.Spice.Simulation.CircuitSimulation.transient
     """
-    circuit = Circuit("Rectify External Voltage")
-
     diode = spice_library['1N4148']
     # The following line is the issue
     # circuit.include(diode)
     pathh = "assets\examples\libraries\diode\general-purpose\BAV21.lib"
     # circuit.include(pathh)
 
-    circuit.V('input', 'input', circuit.gnd, 'dc 0 external')
-    circuit.R(1, 'input', 'output', 700@u_Ohm)
-    circuit.model('1N4148PH', 'D', IS=4.352@u_uA, RS=0.6458@u_Ohm, BV=110@u_V, IBV=0.0001@u_V, N=1.906)
-    circuit.Diode(1, 'output', circuit.gnd, model="1N4148PH")
-    # circuit.X('D1', '1N4148', 'output', circuit.gnd)
-    # circuit.R(2, 'output', circuit.gnd, 700@u_Ohm)
-    print(circuit)
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        ngspice_shared.set_waveform(step_time=1e-6, end_time=0.5)
+        # ngspice_shared.set_waveform(end_time=1)
+        circuit = pickup_sensor_circuit(ngspice_shared.voltage_source, source_mode=source_mode)
+        if source_mode != 'pwl':
+            print(circuit)
 
-    ngspice_shared = MyNgSpiceShared(step_time=1e-6, end_time=0.5)
-    # ngspice_shared = MyNgSpiceShared(end_time=1)
-    simulator = circuit.simulator(temperature=25, nominal_temperature=25,
-        simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
 
-    analysis = simulator.transient(
-        step_time=ngspice_shared.step_time, end_time=ngspice_shared.end_time
-        )
+        analysis = simulator.transient(
+            step_time=ngspice_shared.step_time, end_time=ngspice_shared.end_time
+            )
     # analysis = simulator.transient(step_time=1@u_us, end_time=10*50@u_us)
 
     figure, axis = plt.subplots()
@@ -324,4 +2010,1539 @@ def engine_pickup_sensor_circuit_2():
     axis.legend(('input', 'output'), loc=(0.05, 0.1))
 
     # fig.savefig("meh.png")
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+def benchmark_source_modes(
+        voltages:Sequence=None, step_time:float=1e-6, end_time:float=0.5,
+        modes:Sequence=SOURCE_MODES) -> dict:
+    """ 
+    Runs the pickup sensor transient once per source mode on the same capture.
+    Returns {mode: (seconds, max |output - callback output|)}.
+    """
+    results = dict()
+    reference = None
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        ngspice_shared.set_waveform(voltages, step_time=step_time, end_time=end_time)
+        for mode in modes:
+            circuit = pickup_sensor_circuit(ngspice_shared.voltage_source, source_mode=mode)
+            simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+                simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+            start = time.perf_counter()
+            analysis = simulator.transient(step_time=step_time, end_time=end_time)
+            elapsed = time.perf_counter() - start
+
+            # Compare on a common time axis, the timesteps differ between modes
+            output = np.interp(ngspice_shared.voltage_source.times,
+                np.array(analysis.time), np.array(analysis.output))
+            if reference is None:
+                reference = output
+            results[mode] = (elapsed, float(np.max(np.abs(output - reference))))
+            print("{:>10}: {:8.3f} s, max deviation {:.3g} V".format(mode, *results[mode]))
+    return results
+
+
+def input_bandwidth(values:Sequence, step_time:float, energy_fraction:float=0.999) -> float:
+    """ Frequency below which 'energy_fraction' of the (mean removed) input energy lies, in Hz. """
+    values = np.asarray(values, dtype=np.float64)
+    power = np.abs(np.fft.rfft(values - values.mean())) ** 2
+    cumulative = np.cumsum(power)
+    if cumulative[-1] == 0:
+        return 0.0
+    index = int(np.searchsorted(cumulative, energy_fraction * cumulative[-1]))
+    return float(np.fft.rfftfreq(len(values), step_time)[min(index, len(power) - 1)])
+
+def circuit_time_constants(circuit:Circuit) -> list:
+    """ 
+    Rough time constants (s) of the circuit's reactive parts, fastest first:
+    C * smallest resistance at its nodes, L / largest one, and diode TT and CJO * R.
+    Ground is left out, a resistor to ground only counts for the elements at its other node.
+    Empty for a purely resistive circuit such as pickup_sensor_circuit.
+    """
+    resistances = dict()  # node name: resistances of the resistors touching it
+    for element in circuit.elements:
+        if hasattr(element, 'resistance'):
+            for node in element.nodes:
+                if not node.is_ground_node:
+                    resistances.setdefault(node.name, []).append(float(element.resistance))
+    def node_resistances(element):
+        return [value for node in element.nodes for value in resistances.get(node.name, [])]
+
+    models = {model.name: model for model in circuit.models}
+    time_constants = []
+    for element in circuit.elements:
+        values = node_resistances(element)
+        if hasattr(element, 'capacitance') and values:
+            time_constants.append(float(element.capacitance) * min(values))
+        elif hasattr(element, 'inductance') and values:
+            time_constants.append(float(element.inductance) / max(values))
+        elif getattr(element, 'model', None) is not None:
+            # Models pulled in with .include are not parsed, they are skipped
+            model = models.get(str(element.model))
+            if model is None:
+                continue
+            if model.TT:
+                time_constants.append(float(model.TT))
+            if model.CJO and values:
+                time_constants.append(float(model.CJO) * min(values))
+    return sorted(value for value in time_constants if value > 0)
+
+def propose_timestep(
+        values:Sequence, step_time:float, circuit:Circuit=None, points_per_period:int=20,
+        points_per_time_constant:int=10, energy_fraction:float=0.999) -> dict:
+    """ 
+    step_time/max_time resolving the input bandwidth with 'points_per_period' points
+    and the circuit's fastest time constant with 'points_per_time_constant' points.
+    Never finer than the input's own sampling 'step_time', ngspice refines its steps
+    below max_time on its own where the circuit needs it.
+    """
+    bandwidth = input_bandwidth(values, step_time, energy_fraction)
+    proposal = step_time if bandwidth == 0 else 1 / (points_per_period * bandwidth)
+    time_constants = circuit_time_constants(circuit) if circuit is not None else []
+    if time_constants:
+        proposal = min(proposal, time_constants[0] / points_per_time_constant)
+    proposal = max(proposal, step_time)
+    return {'step_time': proposal, 'max_time': proposal, 'bandwidth': bandwidth, 'time_constants': time_constants}
+
+def timestep_convergence_study(
+        simulate, reference_step:float, tolerance:float, max_step:float, node:str='output') -> dict:
+    """ 
+    Runs simulate(step_time) -> analysis at 'reference_step', then at doubling steps up to 'max_step',
+    and picks the coarsest step whose max |error| on 'node' against the reference stays within
+    'tolerance' (the first failing step ends the study). Returns the choice, its error,
+    the speedup over the reference run and every run as (step, error, seconds).
+    """
+    start = time.perf_counter()
+    reference = simulate(reference_step)
+    reference_seconds = time.perf_counter() - start
+    reference_times = np.array(reference.time)
+    reference_values = np.array(reference[node])
+
+    chosen = (reference_step, 0.0, reference_seconds)
+    runs = [chosen]
+    step = reference_step * 2
+    while step <= max_step:
+        start = time.perf_counter()
+        analysis = simulate(step)
+        seconds = time.perf_counter() - start
+        values = np.interp(reference_times, np.array(analysis.time), np.array(analysis[node]))
+        error = float(np.max(np.abs(values - reference_values)))
+        runs.append((step, error, seconds))
+        if error > tolerance:
+            break
+        chosen = runs[-1]
+        step *= 2
+
+    step, error, seconds = chosen
+    return {'step_time': step, 'error': error, 'tolerance': tolerance, 'reference_step': reference_step,
+        'speedup': reference_seconds / seconds if seconds else None, 'runs': runs}
+
+def select_pickup_timestep(
+        voltages:Sequence=None, step_time:float=1e-6, end_time:float=0.5, tolerance:float=10e-3,
+        study_time:float=50e-3, node:str='output', max_factor:int=4) -> dict:
+    """ 
+    Timestep for the pickup sensor transient: proposes one from the input spectrum and circuit,
+    then checks steps up to 'max_factor' times the proposal against a 'step_time' reference
+    over the first 'study_time' seconds. See timestep_convergence_study for the result.
+    """
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        ngspice_shared.set_waveform(voltages, step_time=step_time, end_time=end_time)
+        circuit = pickup_sensor_circuit(ngspice_shared.voltage_source)
+        proposal = propose_timestep(ngspice_shared.voltages, step_time, circuit)
+
+        def simulate(candidate_step):
+            simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+                simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+            return simulator.transient(step_time=candidate_step, end_time=study_time, max_time=candidate_step)
+
+        study = timestep_convergence_study(simulate, step_time, tolerance,
+            max_step=max_factor * proposal['step_time'], node=node)
+    study['proposal'] = proposal
+    print("step_time {:.3g} s (proposed {:.3g} s, bandwidth {:.3g} Hz): max error {:.3g} V, {:.1f}x faster".format(
+        study['step_time'], proposal['step_time'], proposal['bandwidth'], study['error'], study['speedup'] or 0))
+    return study
+
+
+def periodic_steady_state(
+        circuit:Circuit, period:float, step_time:float, tolerance:float=1e-4,
+        max_periods:int=50, **simulator_kwargs) -> TransientAnalysis:
+    """ 
+    Periodic steady state by repeated single-period transients: the first run starts from the
+    operating point, each next one from the final node voltages of the previous one
+    (.ic with use_initial_condition) until max |V(T) - V(0)| over the nodes is below 'tolerance' (V).
+    The circuit's sources must repeat with 'period', every run restarts at t=0.
+    Only node voltages are fed back, inductor currents restart from their initial conditions.
+    Returns the last cycle, with 'periods' (runs made), 'converged' and 'change' (V) attributes.
+    """
+    initial_state = None
+    for periods in range(1, max_periods + 1):
+        simulator = circuit.simulator(**simulator_kwargs)
+        if initial_state is not None:
+            simulator.initial_condition(**initial_state)
+        analysis = simulator.transient(step_time=step_time, end_time=period,
+            use_initial_condition=initial_state is not None)
+
+        values = {name: np.array(waveform) for name, waveform in analysis.nodes.items() if '#' not in name}
+        change = max(abs(value[-1] - value[0]) for value in values.values())
+        if change <= tolerance:
+            break
+        initial_state = {name: float(value[-1]) for name, value in values.items()}
+
+    analysis.periods = periods
+    analysis.converged = change <= tolerance
+    analysis.change = float(change)
+    if not analysis.converged:
+        logger.warning('No periodic steady state after {} periods, last change {:.3g} V.'.format(periods, change))
+    return analysis
+
+def pickup_steady_cycle(
+        voltages:Sequence=None, step_time:float=1e-6, rpm:float=None, period:float=None,
+        tolerance:float=1e-4, max_periods:int=50) -> TransientAnalysis:
+    """ 
+    One steady cycle of the pickup sensor circuit, see periodic_steady_state.
+    The input is one revolution ('period' seconds, or 60 / 'rpm') taken from the start of 'voltages'.
+    """
+    if period is None:
+        if rpm is None:
+            raise ValueError("Either rpm or period is required.")
+        period = 60 / rpm
+    voltages = _default_voltages(voltages)
+    n_samples = int(round(period / step_time)) + 1
+    if n_samples > len(voltages):
+        raise ValueError("voltages hold {} samples, one period needs {}.".format(len(voltages), n_samples))
+
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        ngspice_shared.set_waveform(voltages[:n_samples], step_time=step_time, end_time=period)
+        circuit = pickup_sensor_circuit(ngspice_shared.voltage_source)
+        return periodic_steady_state(circuit, period, step_time, tolerance=tolerance,
+            max_periods=max_periods, temperature=25, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+
+
+class TransferCurve:
+    """ 
+    Quasi-static surrogate of a circuit: output = f(input) from one DC sweep, applied to whole
+    input arrays with np.interp. Valid while the circuit has no memory at the input's time scale,
+    check it against a transient with 'check'. Inputs outside the sweep get the end values.
+    """
+
+    def __init__(self, inputs:Sequence, outputs:Sequence):
+        self._lookup = SortedLookup(inputs, np.asarray(outputs, dtype=np.float64), mode='linear')
+        # Solver noise can make a monotone curve wiggle, keep it monotone
+        self.monotone = bool(np.all(np.diff(self._lookup.values) >= 0))
+        if not self.monotone:
+            self._lookup.values = np.maximum.accumulate(self._lookup.values)
+        self.error = None
+
+    @classmethod
+    def from_analysis(cls, analysis:DcAnalysis, node:str='output'):
+        return cls(np.array(analysis.sweep), np.array(analysis[node]))
+
+    @property
+    def inputs(self) -> np.ndarray:
+        return self._lookup.keys
+
+    @property
+    def outputs(self) -> np.ndarray:
+        return self._lookup.values
+
+    @property
+    def input_range(self) -> tuple:
+        return float(self.inputs[0]), float(self.inputs[-1])
+
+    def covers(self, values:Sequence) -> bool:
+        values = np.asarray(values)
+        return bool(self.inputs[0] <= values.min() and values.max() <= self.inputs[-1])
+
+    def __call__(self, values:Sequence) -> np.ndarray:
+        return self._lookup(values)
+
+    def check(self, analysis:TransientAnalysis, input_node:str='input', node:str='output') -> float:
+        """ Max |surrogate - transient| on 'node' for the transient's input, kept in 'error'. """
+        self.error = float(np.max(np.abs(self(np.array(analysis[input_node])) - np.array(analysis[node]))))
+        return self.error
+
+def pickup_transfer_curve(
+        voltages:Sequence=None, step_time:float=1e-6, sweep_step:float=1e-3,
+        check_time:float=10e-3, tolerance:float=10e-3) -> TransferCurve:
+    """ 
+    TransferCurve of the pickup sensor circuit over the range of 'voltages', checked against a
+    transient over their first 'check_time' seconds (skipped when 0).
+    Logs a warning when the error exceeds 'tolerance' (V), e.g. at high RPM.
+    """
+    voltages = _default_voltages(voltages)
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        circuit = pickup_sensor_circuit(source_mode='dc')
+        simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        start, stop = float(voltages.min()), float(voltages.max())
+        analysis = simulator.dc(Vinput=slice(start, stop + sweep_step, sweep_step))
+        curve = TransferCurve.from_analysis(analysis)
+
+        if check_time:
+            n_samples = min(int(round(check_time / step_time)) + 1, len(voltages))
+            end_time = (n_samples - 1) * step_time
+            ngspice_shared.set_waveform(voltages[:n_samples], step_time=step_time, end_time=end_time)
+            circuit = pickup_sensor_circuit(ngspice_shared.voltage_source)
+            simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+                simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+            curve.check(simulator.transient(step_time=step_time, end_time=end_time))
+            if curve.error > tolerance:
+                logger.warning('Transfer curve error {:.3g} V exceeds {:.3g} V, use a transient.'.format(
+                    curve.error, tolerance))
+    return curve
+
+
+def _scaled_shockley_diode(
+        IS:float, N:float, temperature:float, nominal_temperature:float=25,
+        EG:float=1.11, XTI:float=3) -> ShockleyDiode:
+    """ ShockleyDiode at 'temperature' (°C), IS scaled from 'nominal_temperature' as SPICE does. """
+    diode = ShockleyDiode(Is=float(IS), n=float(N), degree=temperature)
+    ratio = (temperature + 273.15) / (nominal_temperature + 273.15)
+    diode.Is = float(IS) * ratio ** (float(XTI) / diode.n) * math.exp((ratio - 1) * float(EG) / (diode.n * diode.Vt))
+    return diode
+
+class DiodeClamp:
+    """ 
+    Closed-form solution of the pickup conditioning circuit: a resistor into a Shockley diode
+    (IS, N, RS) to ground, for whole input arrays without a SPICE engine.
+    The series current solves V = I (R + RS) + N Vt ln(1 + I / IS), i.e.
+        I = N Vt / (R + RS) * W(IS (R + RS) / (N Vt) * exp((V + IS (R + RS)) / (N Vt))) - IS
+    with W(exp(z)) evaluated as the Wright omega function to avoid overflow.
+    IS follows SPICE's temperature scaling (EG, XTI); breakdown (BV) and capacitances are ignored.
+    """
+
+    def __init__(
+            self, resistance:float=PICKUP_LOAD_RESISTANCE, IS:float=1e-14, N:float=1, RS:float=0,
+            temperature:float=25, nominal_temperature:float=25, EG:float=1.11, XTI:float=3):
+        self.resistance = float(resistance)
+        self.series_resistance = float(RS)
+        self.temperature = temperature
+        self.diode = _scaled_shockley_diode(IS, N, temperature, nominal_temperature, EG, XTI)
+
+    @classmethod
+    def from_parameters(
+            cls, load_resistance=PICKUP_LOAD_RESISTANCE, diode_parameters:dict=None, temperature:float=25):
+        """ Same parameters as pickup_sensor_circuit. """
+        parameters = dict(PICKUP_DIODE_PARAMETERS, **(diode_parameters or {}))
+        names = ('IS', 'N', 'RS', 'EG', 'XTI')
+        return cls(load_resistance, temperature=temperature,
+            **{name: float(value) for name, value in parameters.items() if name in names})
+
+    def current(self, voltages:Sequence) -> np.ndarray:
+        """ Current through the resistor and diode (A) for input 'voltages' (V). """
+        voltages = np.asarray(voltages, dtype=np.float64)
+        n_vt = self.diode.n * self.diode.Vt
+        resistance = self.resistance + self.series_resistance
+        Is = self.diode.Is
+        z = math.log(Is * resistance / n_vt) + (voltages + Is * resistance) / n_vt
+        return n_vt / resistance * special.wrightomega(z) - Is
+
+    def __call__(self, voltages:Sequence) -> np.ndarray:
+        """ Output node voltage (diode anode, RS included) for input 'voltages'. """
+        voltages = np.asarray(voltages, dtype=np.float64)
+        return voltages - self.resistance * self.current(voltages)
+
+def diode_clamp_accuracy(
+        voltages:Sequence=None, sweep_step:float=1e-3, load_resistance=PICKUP_LOAD_RESISTANCE,
+        diode_parameters:dict=None, temperature:float=25) -> dict:
+    """ 
+    DiodeClamp against an ngspice DC sweep of pickup_sensor_circuit over the range of 'voltages'.
+    Returns the max and RMS output error (V) and the time to map all of 'voltages' with each:
+    the closed form directly, ngspice as its sweep followed by interpolation.
+    """
+    voltages = _default_voltages(voltages)
+    clamp = DiodeClamp.from_parameters(load_resistance, diode_parameters, temperature)
+    start = time.perf_counter()
+    clamp(voltages)
+    analytic_seconds = time.perf_counter() - start
+
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        circuit = pickup_sensor_circuit(source_mode='dc', load_resistance=load_resistance,
+            diode_parameters=diode_parameters)
+        simulator = circuit.simulator(temperature=temperature, nominal_temperature=25,
+            simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+        start = time.perf_counter()
+        analysis = simulator.dc(Vinput=slice(float(voltages.min()), float(voltages.max()) + sweep_step, sweep_step))
+        TransferCurve.from_analysis(analysis)(voltages)
+        ngspice_seconds = time.perf_counter() - start
+
+    errors = clamp(np.array(analysis.sweep)) - np.array(analysis.output)
+    report = {
+        'max_error': float(np.max(np.abs(errors))),
+        'rms_error': float(np.sqrt(np.mean(errors ** 2))),
+        'analytic_seconds': analytic_seconds,
+        'ngspice_seconds': ngspice_seconds,
+    }
+    print("max error {max_error:.3g} V, rms {rms_error:.3g} V; "
+        "{analytic_seconds:.3f} s analytic vs {ngspice_seconds:.3f} s ngspice".format(**report))
+    return report
+
+
+def parameter_grid(**axes) -> list:
+    """ Every combination of the given parameter values, e.g. parameter_grid(amplitude=[1, 2], N=[1.8, 1.9]). """
+    names = list(axes.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+# One ngspice instance and base input per sweep worker process, set by _init_sweep_worker
+_sweep_worker = None
+_sweep_voltages = None
+_sweep_step_time = None
+_sweep_end_time = None
+
+def _init_sweep_worker(voltages, step_time:float, end_time:float):
+    global _sweep_worker, _sweep_voltages, _sweep_step_time, _sweep_end_time
+    _sweep_worker = MyNgSpiceShared(voltages=voltages, step_time=step_time, end_time=end_time)
+    _sweep_voltages = _sweep_worker.voltages
+    _sweep_step_time = step_time
+    _sweep_end_time = end_time
+
+def _simulate_pickup_parameters(parameters:dict, times:np.ndarray, nodes:Sequence) -> np.ndarray:
+    """ Sweep job: builds the circuit for one parameter set, returns the nodes resampled on 'times'. """
+    parameters = dict(parameters)
+    ngspice_shared = _sweep_worker
+    amplitude = parameters.pop('amplitude', 1.0)
+    load_resistance = parameters.pop('load_resistance', PICKUP_LOAD_RESISTANCE)
+    temperature = parameters.pop('temperature', 25)
+    ngspice_shared.set_waveform(amplitude * _sweep_voltages, step_time=_sweep_step_time, end_time=_sweep_end_time)
+
+    circuit = pickup_sensor_circuit(load_resistance=load_resistance, diode_parameters=parameters)
+    simulator = circuit.simulator(temperature=temperature, nominal_temperature=25,
+        simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+    analysis = simulator.transient(step_time=ngspice_shared.step_time, end_time=ngspice_shared.end_time)
+    analysis_times = np.array(analysis.time)
+    return np.stack([np.interp(times, analysis_times, np.array(analysis[node])) for node in nodes])
+
+def sweep_pickup_sensor_circuit(
+        parameter_sets:Sequence, voltages:Sequence=None, step_time:float=1e-6, end_time:float=0.5,
+        nodes:Sequence=('output',), max_workers:int=None) -> tuple:
+    """ 
+    Simulates the pickup sensor circuit for each parameter set across a process pool.
+    A parameter set is a dict of 'amplitude' (input scale), 'load_resistance', 'temperature'
+    and diode model parameters (IS, N, RS, ...), see parameter_grid.
+    Each worker process holds its own NgSpiceShared instance.
+    Returns (times, values) with values shaped (parameter sets, nodes, times).
+    """
+    voltages = _default_voltages(voltages)
+    times = np.arange(int(round(end_time / step_time)) + 1) * step_time
+    parameter_sets = list(parameter_sets)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker,
+            initargs=(voltages, step_time, end_time)) as executor:
+        results = executor.map(_simulate_pickup_parameters, parameter_sets,
+            itertools.repeat(times), itertools.repeat(tuple(nodes)))
+        return times, np.stack(list(results))
+
+
+EDGE_DIRECTIONS = ('rising', 'falling', 'both')
+
+def edge_times(times:Sequence, values:Sequence, threshold:float=0.0, direction:str='rising') -> np.ndarray:
+    """ Times at which 'values' cross 'threshold', linearly interpolated between samples. """
+    if direction not in EDGE_DIRECTIONS:
+        raise ValueError("direction '{}' is not one of {}.".format(direction, EDGE_DIRECTIONS))
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    above = values > threshold
+    indices = np.flatnonzero(above[1:] != above[:-1])
+    if direction == 'rising':
+        indices = indices[above[indices + 1]]
+    elif direction == 'falling':
+        indices = indices[~above[indices + 1]]
+    t0, t1 = times[indices], times[indices + 1]
+    v0, v1 = values[indices], values[indices + 1]
+    return t0 + (threshold - v0) * (t1 - t0) / (v1 - v0)
+
+def edge_delays(reference_edges:Sequence, edges:Sequence) -> np.ndarray:
+    """ Signed delay from each reference edge to the nearest edge, empty without edges. """
+    reference_edges = np.asarray(reference_edges, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    if not len(edges) or not len(reference_edges):
+        return np.empty(0)
+    after = np.clip(np.searchsorted(edges, reference_edges), 0, len(edges) - 1)
+    before = np.clip(after - 1, 0, len(edges) - 1)
+    delays_after = edges[after] - reference_edges
+    delays_before = edges[before] - reference_edges
+    return np.where(np.abs(delays_before) < np.abs(delays_after), delays_before, delays_after)
+
+RPM_METRICS = ('edges', 'delay_mean', 'delay_std', 'delay_min', 'delay_max', 'delay_degrees', 'output_peak')
+
+def _rpm_metrics(rpm:float, zero_crossings, trigger_edges, output_peak:float) -> dict:
+    delays = edge_delays(zero_crossings, trigger_edges)
+    if not len(delays):
+        return dict(dict.fromkeys(RPM_METRICS, math.nan), edges=0, output_peak=output_peak)
+    return {
+        'edges': len(trigger_edges),
+        'delay_mean': float(delays.mean()),
+        'delay_std': float(delays.std()),
+        'delay_min': float(delays.min()),
+        'delay_max': float(delays.max()),
+        # Crank angle of the mean delay
+        'delay_degrees': float(delays.mean() * rpm / 60 * 360),
+        'output_peak': output_peak,
+    }
+
+def _simulate_pickup_rpm(rpm:float, base_rpm:float, scale_amplitude:bool, edge_parameters:tuple) -> tuple:
+    """ RPM sweep job: the base input replayed 'base_rpm / rpm' times slower, returns the edges. """
+    input_threshold, input_direction, trigger_threshold, trigger_direction = edge_parameters
+    ngspice_shared = _sweep_worker
+    time_scale = base_rpm / rpm
+    # Induced voltage grows with the speed of the passing tooth
+    amplitude = 1 / time_scale if scale_amplitude else 1.0
+    ngspice_shared.set_waveform(amplitude * _sweep_voltages,
+        step_time=_sweep_step_time * time_scale, end_time=_sweep_end_time * time_scale)
+
+    circuit = pickup_sensor_circuit(ngspice_shared.voltage_source)
+    simulator = circuit.simulator(temperature=25, nominal_temperature=25,
+        simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+    analysis = simulator.transient(step_time=ngspice_shared.step_time, end_time=ngspice_shared.end_time)
+    times = np.array(analysis.time)
+    output = np.array(analysis.output)
+    return (edge_times(times, np.array(analysis.input), input_threshold, input_direction),
+        edge_times(times, output, trigger_threshold, trigger_direction), float(output.max()))
+
+def sweep_pickup_rpm(
+        rpms:Sequence, voltages:Sequence=None, step_time:float=1e-6, base_rpm:float=1000,
+        scale_amplitude:bool=True, input_threshold:float=0.0, input_direction:str='falling',
+        trigger_threshold:float=0.5, trigger_direction:str='rising', max_workers:int=None,
+        cache_dir:str=None) -> dict:
+    """ 
+    Trigger timing of the pickup sensor circuit across RPM.
+    'voltages' (a capture or synthetic waveform sampled every 'step_time') was taken at 'base_rpm',
+    each RPM replays it time-scaled (and amplitude-scaled with 'scale_amplitude') in a worker process.
+    Delays run from each input zero-crossing ('input_threshold'/'input_direction') to the nearest
+    output trigger edge ('trigger_threshold'/'trigger_direction'). Edges are cached per RPM
+    in 'cache_dir', so extending the list only simulates the new RPMs.
+    Returns the RPM x metric table {'rpm': array, metric: array}, see RPM_METRICS.
+    """
+    voltages = _default_voltages(voltages)
+    end_time = (len(voltages) - 1) * step_time
+    edge_parameters = (input_threshold, input_direction, trigger_threshold, trigger_direction)
+    cache_dir = cache_dir if cache_dir is not None else RPM_SWEEP_CACHE_PATH
+    os.makedirs(cache_dir, exist_ok=True)
+    base_key = '\n'.join((waveform_hash(voltages),
+        repr((step_time, base_rpm, scale_amplitude, edge_parameters)), str(pickup_sensor_circuit())))
+
+    rpms = [float(rpm) for rpm in rpms]
+    paths = {rpm: os.path.join(cache_dir, hashlib.sha256('{}\n{!r}'.format(base_key, rpm).encode()).hexdigest() + '.npz')
+        for rpm in rpms}
+    missing = [rpm for rpm in dict.fromkeys(rpms) if not os.path.exists(paths[rpm])]
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker,
+                initargs=(voltages, step_time, end_time)) as executor:
+            results = executor.map(_simulate_pickup_rpm, missing, itertools.repeat(base_rpm),
+                itertools.repeat(scale_amplitude), itertools.repeat(edge_parameters))
+            for rpm, (zero_crossings, trigger_edges, output_peak) in zip(missing, results):
+                with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as file:
+                    np.savez(file, zero_crossings=zero_crossings, trigger_edges=trigger_edges,
+                        output_peak=output_peak)
+                os.replace(file.name, paths[rpm])
+        _evict_lru(cache_dir, SIMULATION_CACHE_MAX_BYTES,
+            keep={os.path.basename(path).split('.', 1)[0] for path in paths.values()})
+
+    rows = []
+    for rpm in rpms:
+        with np.load(paths[rpm]) as data:
+            rows.append(_rpm_metrics(rpm, data['zero_crossings'], data['trigger_edges'], float(data['output_peak'])))
+    table = {'rpm': np.array(rpms)}
+    table.update({metric: np.array([row[metric] for row in rows]) for metric in RPM_METRICS})
+    return table
+
+def write_rpm_table(filename:str, table:dict):
+    """ Writes a sweep_pickup_rpm table as CSV, one row per RPM. """
+    names = list(table.keys())
+    np.savetxt(filename, np.column_stack([table[name] for name in names]), delimiter=',', fmt='%.9g',
+        header=','.join(names), comments='')
+
+
+def waveform_hash(*arrays) -> str:
+    """ sha256 of the content of the given arrays, for cache keys. """
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(array.dtype.str.encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+def _simulator_input_hash(simulator) -> str:
+    """ 
+    Hash of the external waveforms served to the simulator, by its MyNgSpiceShared or by
+    MnaCircuitSimulator itself, '' without any.
+    Only the configured sources count (default waveform, per-name tables, default current),
+    not what the callbacks resolved so far, so reruns on the same instance share a key.
+    None when a source cannot be hashed (streamed or live input), such runs are not cached.
+    """
+    if isinstance(simulator, MnaCircuitSimulator):
+        sources = [('', simulator.voltage_source)] + \
+            sorted(('v' + name, source) for name, source in simulator.voltage_sources.items()) + \
+            sorted(('i' + name, source) for name, source in simulator.current_sources.items())
+        default_current = simulator.default_current
+    else:
+        ngspice_shared = getattr(simulator, 'ngspice', None)
+        if not isinstance(ngspice_shared, MyNgSpiceShared):
+            return ''
+        sources = [('', ngspice_shared.voltage_source)] + \
+            sorted(ngspice_shared._vsrc_table.items()) + sorted(ngspice_shared._isrc_table.items())
+        default_current = ngspice_shared.default_current
+    hashes = ['i*={!r}'.format(default_current)]
+    for name, source in sources:
+        if source is None:
+            continue
+        if not isinstance(source, WaveformSource):
+            return None
+        hashes.append('{}={}:{}:{}'.format(name, source.interpolation, source.default_value,
+            waveform_hash(source.times, source.values)))
+    return hashlib.sha256('|'.join(hashes).encode()).hexdigest()
+
+def _waveforms_to_arrays(prefix:str, waveforms:dict) -> dict:
+    return {'{}{}'.format(prefix, name): np.array(waveform) for name, waveform in waveforms.items()}
+
+def _arrays_to_waveforms(prefix:str, arrays:dict, abscissa=None) -> list:
+    waveforms = []
+    for key, array in arrays.items():
+        if key.startswith(prefix):
+            waveform = WaveForm(key[len(prefix):], None, array.shape, dtype=array.dtype, abscissa=abscissa)
+            waveform[...] = array
+            waveforms.append(waveform)
+    return waveforms
+
+class SimulationCache:
+    """ 
+    Content-addressed cache of analysis results, stored as compressed '.npz' files.
+    The key hashes the rendered netlist with simulator options, the analysis name and arguments,
+    and the input waveforms of external sources. Size-capped with LRU eviction.
+    Supports operating_point, dc, ac and transient analyses.
+    """
+
+    ANALYSES = {
+        # analysis name: (abscissa attribute, PySpice analysis class)
+        'operating_point': (None, OperatingPoint),
+        'dc': ('sweep', DcAnalysis),
+        'ac': ('frequency', AcAnalysis),
+        'transient': ('time', TransientAnalysis),
+    }
+
+    def __init__(self, directory:str=None, max_bytes:int=SIMULATION_CACHE_MAX_BYTES):
+        self.directory = directory if directory is not None else SIMULATION_CACHE_PATH
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, simulator, analysis_name:str, args:tuple, kwargs:dict, input_hash:str) -> str:
+        text = '\n'.join((type(simulator).__name__, str(simulator), analysis_name,
+            repr(args), repr(sorted(kwargs.items())), input_hash))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def run(self, simulator, analysis_name:str, *args, input_hash:str=None, **kwargs):
+        """ 
+        Returns simulator.<analysis_name>(*args, **kwargs), from the cache when possible.
+        input_hash overrides the hash of the external input waveforms.
+        """
+        if analysis_name not in self.ANALYSES:
+            raise ValueError("analysis '{}' is not one of {}.".format(analysis_name, list(self.ANALYSES)))
+        if input_hash is None:
+            input_hash = _simulator_input_hash(simulator)
+        if input_hash is None:
+            self.uncacheable += 1
+            return getattr(simulator, analysis_name)(*args, **kwargs)
+
+        path = os.path.join(self.directory, self.key(simulator, analysis_name, args, kwargs, input_hash) + '.npz')
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path)
+            return self._load(path, analysis_name)
+
+        self.misses += 1
+        analysis = getattr(simulator, analysis_name)(*args, **kwargs)
+        self._save(path, analysis_name, analysis)
+        _evict_lru(self.directory, self.max_bytes)
+        return analysis
+
+    def _save(self, path:str, analysis_name:str, analysis):
+        abscissa_name, _ = self.ANALYSES[analysis_name]
+        arrays = dict(_waveforms_to_arrays('node:', analysis.nodes), **_waveforms_to_arrays('branch:', analysis.branches))
+        if abscissa_name is not None:
+            arrays['abscissa'] = np.array(getattr(analysis, abscissa_name))
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(file.name, path)
+
+    def _load(self, path:str, analysis_name:str):
+        abscissa_name, analysis_class = self.ANALYSES[analysis_name]
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files}
+        kwargs = dict()
+        abscissa = None
+        if abscissa_name is not None:
+            abscissa = _arrays_to_waveforms('', {abscissa_name: arrays.pop('abscissa')})[0]
+            kwargs[abscissa_name] = abscissa
+        return analysis_class(simulation=None, nodes=_arrays_to_waveforms('node:', arrays, abscissa),
+            branches=_arrays_to_waveforms('branch:', arrays, abscissa), internal_parameters=[], **kwargs)
+
+    @property
+    def size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'uncacheable': self.uncacheable,
+            'hit_rate': self.hits / lookups if lookups else None, 'bytes': self.size}
+
+class CachedSimulator:
+    """ 
+    Wraps circuit.simulator(...), serving operating_point/dc/ac/transient through a SimulationCache.
+    Everything else is forwarded to the wrapped simulator.
+    """
+
+    def __init__(self, simulator, cache:SimulationCache=None):
+        self.simulator = simulator
+        self.cache = cache if cache is not None else SimulationCache()
+
+    def __getattr__(self, name):
+        if name in SimulationCache.ANALYSES:
+            return lambda *args, **kwargs: self.cache.run(self.simulator, name, *args, **kwargs)
+        return getattr(self.simulator, name)
+
+
+class ConvergenceError(RuntimeError):
+    pass
+
+def _pnjlim(vnew:np.ndarray, vold:np.ndarray, n_vt:np.ndarray, vcrit:np.ndarray) -> np.ndarray:
+    """ SPICE's junction voltage limiting, keeps Newton from overshooting into exp() overflow. """
+    limit = (vnew > vcrit) & (np.abs(vnew - vold) > 2 * n_vt)
+    if not limit.any():
+        return vnew
+    with np.errstate(invalid='ignore', divide='ignore'):
+        argument = 1 + (vnew - vold) / n_vt
+        from_old = np.where(argument > 0, vold + n_vt * np.log(argument), vcrit)
+        from_zero = n_vt * np.log(vnew / n_vt)
+    return np.where(limit, np.where(vold > 0, from_old, from_zero), vnew)
+
+SPICE_SCALE_FACTORS = {'f': 1e-15, 'p': 1e-12, 'n': 1e-9, 'u': 1e-6, 'µ': 1e-6, 'm': 1e-3,
+    'k': 1e3, 'meg': 1e6, 'g': 1e9, 't': 1e12}
+SPICE_NUMBER_PATTERN = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?)(meg|[fpnuµmkgt])?[a-zω]*\s*')
+
+def _spice_number(text) -> float:
+    """ SPICE number with optional scale factor and unit, e.g. '1.5mV' or '10k'. """
+    match = SPICE_NUMBER_PATTERN.fullmatch(str(text).lower())
+    if match is None:
+        raise ValueError("'{}' is not a SPICE number.".format(text))
+    return float(match.group(1)) * SPICE_SCALE_FACTORS.get(match.group(2), 1)
+
+def _source_waveform(element, step_time:float):
+    """ Time function of an independent source element, None for an external one. """
+    if isinstance(element, (SinusoidalVoltageSource, SinusoidalCurrentSource)):
+        offset, amplitude = float(element.offset), float(element.amplitude)
+        frequency, delay, damping = float(element.frequency), float(element.delay), float(element.damping_factor)
+        def waveform(time):
+            if time < delay:
+                return offset
+            time -= delay
+            return offset + amplitude * math.exp(-damping * time) * math.sin(2 * math.pi * frequency * time)
+        return waveform
+    if isinstance(element, (PulseVoltageSource, PulseCurrentSource)):
+        low, high = float(element.initial_value), float(element.pulsed_value)
+        delay, width, period = float(element.delay_time), float(element.pulse_width), float(element.period)
+        # SPICE uses the step for zero rise and fall times, ideal edges without one (op, dc)
+        rise = float(element.rise_time) or step_time or 0.0
+        fall = float(element.fall_time) or step_time or 0.0
+        def waveform(time):
+            if time < delay:
+                return low
+            time = (time - delay) % period
+            if time < rise or time == 0:
+                return low + (high - low) * time / rise if rise else low
+            if time < rise + width:
+                return high
+            if time < rise + width + fall:
+                return high + (low - high) * (time - rise - width) / fall
+            return low
+        return waveform
+    value = element.dc_value
+    if isinstance(value, str):
+        words = value.lower().split()
+        if 'external' in words:
+            return None
+        try:
+            value = _spice_number(words[1] if len(words) >= 2 and words[0] == 'dc' else value)
+        except ValueError:
+            raise ValueError("Source value '{}' of {} is not supported.".format(value, element.name))
+    value = float(value)
+    return lambda time: value
+
+class MnaCircuitSimulator(CircuitSimulator):
+    """ 
+    Pure NumPy/SciPy simulator for small circuits, select it with
+        circuit.simulator(simulator='numpy-mna', ...)
+    Modified nodal analysis, assembled as sparse matrices (solved dense below DENSE_LIMIT unknowns,
+    where LAPACK beats SuperLU), trapezoidal or backward Euler companion models for C and L and a
+    Newton solve with junction limiting per fixed timestep (halved on non-convergence).
+    Supports R, C, L, DC/SIN/PULSE and external V/I sources, diodes (level-1 IS, N, RS, EG, XTI;
+    CJO, TT and breakdown are ignored) and subcircuits defined in Python.
+    External sources are served like MyNgSpiceShared does: 'voltage_sources'/'current_sources' map
+    source names to callables of time, 'voltage_source' serves the other external V sources;
+    a MyNgSpiceShared passed as 'ngspice_shared' lends its sources.
+    Analyses: operating_point, dc (one source) and transient (max_time bounds the step,
+    use_initial_condition takes node voltages from initial_condition, else starts from the operating point).
+    """
+
+    _logger = logger.getChild('MnaCircuitSimulator')
+
+    # Netlist dialect of str(simulator), e.g. for SimulationCache keys
+    SIMULATOR = 'ngspice'
+    DENSE_LIMIT = 64
+    GMIN = 1e-12
+    INTEGRATIONS = ('trapezoidal', 'euler')
+
+    def __init__(
+            self, circuit:Circuit, voltage_sources:dict=None, current_sources:dict=None,
+            voltage_source=None, default_voltage:float=0, default_current:float=0,
+            integration:str='trapezoidal', reltol:float=1e-3, vntol:float=1e-6,
+            max_iterations:int=100, max_halvings:int=10, ngspice_shared=None, **kwargs):
+        if integration not in self.INTEGRATIONS:
+            raise ValueError("integration '{}' is not one of {}.".format(integration, self.INTEGRATIONS))
+        super().__init__(circuit, **kwargs)
+        self.voltage_sources = {name.lower(): source for name, source in (voltage_sources or {}).items()}
+        self.current_sources = {name.lower(): source for name, source in (current_sources or {}).items()}
+        self.voltage_source = voltage_source
+        self.default_voltage = default_voltage
+        self.default_current = default_current
+        if isinstance(ngspice_shared, MyNgSpiceShared):
+            self.voltage_sources.update({name[1:]: source for name, source in ngspice_shared._vsrc_table.items()})
+            self.current_sources.update({name[1:]: source for name, source in ngspice_shared._isrc_table.items()})
+            if self.voltage_source is None:
+                self.voltage_source = ngspice_shared.voltage_source
+            self.default_current = ngspice_shared.default_current
+        self.integration = integration
+        self.reltol = reltol
+        self.vntol = vntol
+        self.max_iterations = max_iterations
+        self.max_halvings = max_halvings
+        self.newton_iterations = 0
+
+    # Netlist
+
+    def _flatten(self, netlist, prefix:str='', node_map:dict=None, subcircuits:dict=None, models:dict=None):
+        """ Yields (element, node names) with subcircuit instances expanded, collecting models. """
+        if str(getattr(netlist, 'raw_spice', '') or '').strip():
+            # e.g. the 'pwl' and 'filesource' source modes, dropping it would leave nodes undriven
+            raise ValueError("Raw SPICE lines of '{}' are not supported by {}.".format(
+                getattr(netlist, 'title', None) or netlist.name, type(self).__name__))
+        node_map = node_map or {}
+        subcircuits = dict(subcircuits or {}, **{subcircuit.name: subcircuit for subcircuit in netlist.subcircuits})
+        models.update({model.name: model for model in netlist.models})
+        for element in netlist.elements:
+            nodes = [node.name if node.name == '0' else node_map.get(node.name, prefix + node.name)
+                for node in element.nodes]
+            if isinstance(element, SubCircuitElement):
+                subcircuit = subcircuits.get(element.subcircuit_name)
+                if subcircuit is None:
+                    raise ValueError("Subcircuit '{}' of {} is not defined in Python (library .include?).".format(
+                        element.subcircuit_name, element.name))
+                yield from self._flatten(subcircuit, prefix + element.name + '.',
+                    dict(zip(subcircuit.external_nodes, nodes)), subcircuits, models)
+            else:
+                yield element, prefix + element.name, nodes
+
+    def _external_source(self, element, name:str):
+        key = element.name[1:].lower()
+        if isinstance(element, VoltageSource):
+            source = self.voltage_sources.get(key, self.voltage_source)
+            default = self.default_voltage
+        else:
+            source = self.current_sources.get(key)
+            default = self.default_current
+        return source if source is not None else (lambda time: default)
+
+    def _build(self, step_time:float=None):
+        """ Flattens the circuit into index arrays, see _linear_matrix / _newton. """
+        models = dict()
+        elements = list(self._flatten(self._circuit, models=models))
+        temperature = float(self.temperature)
+        nominal_temperature = float(self.nominal_temperature)
+
+        node_names = []
+        node_index = {'0': None}
+        def index(name):
+            if name not in node_index:
+                node_index[name] = len(node_names)
+                node_names.append(name)
+            return node_index[name]
+
+        resistors, capacitors, inductors, voltage_sources, current_sources, diodes = [], [], [], [], [], []
+        for element, name, nodes in elements:
+            a, b = (index(node) for node in nodes[:2])
+            if isinstance(element, Resistor):
+                resistors.append((a, b, float(element.resistance)))
+            elif isinstance(element, Capacitor):
+                capacitors.append((a, b, float(element.capacitance)))
+            elif isinstance(element, Inductor):
+                inductors.append((name, a, b, float(element.inductance)))
+            elif isinstance(element, (VoltageSource, CurrentSource)):
+                waveform = _source_waveform(element, step_time)
+                if waveform is None:
+                    waveform = self._external_source(element, name)
+                (voltage_sources if isinstance(element, VoltageSource) else current_sources).append((name, a, b, waveform))
+            elif isinstance(element, Diode):
+                model = models.get(str(element.model))
+                if model is None:
+                    raise ValueError("Diode model '{}' of {} is not defined.".format(element.model, name))
+                if any(model[parameter] for parameter in ('CJO', 'TT') if parameter in model.parameters):
+                    self._logger.warning('{}: CJO and TT are ignored.'.format(name))
+                parameters = {parameter: float(model[parameter]) for parameter in ('IS', 'N', 'RS', 'EG', 'XTI')
+                    if parameter in model.parameters}
+                if parameters.get('RS'):
+                    # Series resistance to an internal anode node
+                    anode = index(name + '#internal')
+                    resistors.append((a, anode, parameters['RS']))
+                    a = anode
+                diode = _scaled_shockley_diode(parameters.get('IS', 1e-14), parameters.get('N', 1),
+                    temperature, nominal_temperature, parameters.get('EG', 1.11), parameters.get('XTI', 3))
+                diodes.append((a, b, diode.Is, diode.n * diode.Vt))
+            else:
+                raise TypeError("{} ({}) is not supported.".format(name, type(element).__name__))
+
+        self._node_names = node_names
+        n_nodes = len(node_names)
+        ground = n_nodes + len(voltage_sources) + len(inductors)
+        def ground_index(value):
+            return ground if value is None else value
+
+        self._size = ground
+        self._branch_names = [name for name, *_ in voltage_sources] + [name for name, *_ in inductors]
+        self._resistors = [(ground_index(a), ground_index(b), 1 / value) for a, b, value in resistors]
+        self._voltage_sources = [(name.lower(), n_nodes + k, ground_index(a), ground_index(b), waveform)
+            for k, (name, a, b, waveform) in enumerate(voltage_sources)]
+        self._current_sources = [(name.lower(), ground_index(a), ground_index(b), waveform)
+            for name, a, b, waveform in current_sources]
+        self._inductors = [(n_nodes + len(voltage_sources) + k, ground_index(a), ground_index(b), value)
+            for k, (name, a, b, value) in enumerate(inductors)]
+
+        self._capacitor_nodes = np.array([(ground_index(a), ground_index(b)) for a, b, _ in capacitors], dtype=np.intp).reshape(-1, 2)
+        self._capacitances = np.array([value for _, _, value in capacitors])
+
+        self._diode_nodes = np.array([(ground_index(a), ground_index(b)) for a, b, _, _ in diodes], dtype=np.intp).reshape(-1, 2)
+        self._diode_is = np.array([value for _, _, value, _ in diodes])
+        self._diode_n_vt = np.array([value for _, _, _, value in diodes])
+        self._diode_vcrit = self._diode_n_vt * np.log(self._diode_n_vt / (math.sqrt(2) * self._diode_is))
+        # Diode conductance stamps: (row, col, sign, diode) without the ground row/column
+        stamps = [(a, a, 1, k) for k, (a, b) in enumerate(self._diode_nodes)] + \
+            [(b, b, 1, k) for k, (a, b) in enumerate(self._diode_nodes)] + \
+            [(a, b, -1, k) for k, (a, b) in enumerate(self._diode_nodes)] + \
+            [(b, a, -1, k) for k, (a, b) in enumerate(self._diode_nodes)]
+        stamps = np.array([stamp for stamp in stamps if ground not in stamp[:2]], dtype=np.intp).reshape(-1, 4)
+        self._diode_stamps = stamps
+
+    def _linear_matrix(self, h:float=None, integration:str=None):
+        """ Matrix of the linear elements, with companion models for step 'h' (None: DC). """
+        factor = 2 if (integration or self.integration) == 'trapezoidal' else 1
+        rows, cols, values = [], [], []
+        def stamp(a, b, value):
+            rows.extend((a, b, a, b))
+            cols.extend((a, b, b, a))
+            values.extend((value, value, -value, -value))
+        for a, b, conductance in self._resistors:
+            stamp(a, b, conductance)
+        if h is not None:
+            for (a, b), capacitance in zip(self._capacitor_nodes, self._capacitances):
+                stamp(a, b, factor * capacitance / h)
+        for _, k, a, b, _ in self._voltage_sources:
+            rows.extend((a, b, k, k))
+            cols.extend((k, k, a, b))
+            values.extend((1, -1, 1, -1))
+        for k, a, b, inductance in self._inductors:
+            rows.extend((a, b, k, k))
+            cols.extend((k, k, a, b))
+            values.extend((1, -1, 1, -1))
+            if h is not None:
+                rows.append(k)
+                cols.append(k)
+                values.append(-factor * inductance / h)
+        n_nodes = len(self._node_names)
+        rows.extend(range(n_nodes))
+        cols.extend(range(n_nodes))
+        values.extend([self.GMIN] * n_nodes)
+
+        size = self._size
+        rows, cols, values = np.array(rows), np.array(cols), np.array(values, dtype=np.float64)
+        keep = (rows != size) & (cols != size)
+        matrix = sparse.csc_matrix((values[keep], (rows[keep], cols[keep])), shape=(size, size))
+        if size <= self.DENSE_LIMIT:
+            matrix = matrix.toarray()
+            return matrix, (None if len(self._diode_is) else linalg.lu_factor(matrix))
+        return matrix, (None if len(self._diode_is) else sparse_linalg.splu(matrix))
+
+    def _source_vector(self, time:float, overrides:dict=None) -> np.ndarray:
+        """ Right-hand side of the sources at 'time', 'overrides' maps source names to values. """
+        overrides = overrides or {}
+        rhs = np.zeros(self._size + 1)
+        for name, k, a, b, waveform in self._voltage_sources:
+            rhs[k] = overrides[name] if name in overrides else waveform(time)
+        for name, a, b, waveform in self._current_sources:
+            current = overrides[name] if name in overrides else waveform(time)
+            rhs[a] -= current
+            rhs[b] += current
+        return rhs
+
+    def _solve(self, matrix, factorization, rhs:np.ndarray) -> np.ndarray:
+        if factorization is not None:
+            if isinstance(factorization, tuple):
+                return linalg.lu_solve(factorization, rhs)
+            return factorization.solve(rhs)
+        if isinstance(matrix, np.ndarray):
+            return np.linalg.solve(matrix, rhs)
+        return sparse_linalg.spsolve(matrix.tocsc(), rhs)
+
+    def _newton(self, linear, rhs:np.ndarray, x:np.ndarray, vd:np.ndarray) -> tuple:
+        """ Solves one timepoint from guess 'x' (with ground appended), returns (x, diode voltages). """
+        matrix, factorization = linear
+        size = self._size
+        if not len(self._diode_is):
+            x = np.append(self._solve(matrix, factorization, rhs[:size]), 0)
+            return x, vd
+
+        stamps = self._diode_stamps
+        anodes, cathodes = self._diode_nodes[:, 0], self._diode_nodes[:, 1]
+        for _ in range(self.max_iterations):
+            self.newton_iterations += 1
+            vd_new = x[anodes] - x[cathodes]
+            vd_limited = _pnjlim(vd_new, vd, self._diode_n_vt, self._diode_vcrit)
+            exponential = np.exp(vd_limited / self._diode_n_vt)
+            current = self._diode_is * (exponential - 1)
+            conductance = self._diode_is / self._diode_n_vt * exponential + self.GMIN
+            equivalent = current - conductance * vd_limited
+
+            values = stamps[:, 2] * conductance[stamps[:, 3]]
+            if isinstance(matrix, np.ndarray):
+                system = matrix.copy()
+                np.add.at(system, (stamps[:, 0], stamps[:, 1]), values)
+            else:
+                system = matrix + sparse.csc_matrix((values, (stamps[:, 0], stamps[:, 1])), shape=(size, size))
+            total_rhs = rhs - np.bincount(anodes, equivalent, minlength=size + 1) \
+                + np.bincount(cathodes, equivalent, minlength=size + 1)
+            x_new = np.append(self._solve(system, None, total_rhs[:size]), 0)
+
+            converged = np.all(np.abs(x_new - x) <= self.reltol * np.maximum(np.abs(x_new), np.abs(x)) + self.vntol) \
+                and np.array_equal(vd_limited, vd_new)
+            x, vd = x_new, vd_limited
+            if converged:
+                return x, x[anodes] - x[cathodes]
+        raise ConvergenceError("Newton did not converge in {} iterations.".format(self.max_iterations))
+
+    def _dc_solution(self, time:float=0, overrides:dict=None, x:np.ndarray=None) -> np.ndarray:
+        linear = self._dc_linear
+        x = x if x is not None else np.zeros(self._size + 1)
+        x, _ = self._newton(linear, self._source_vector(time, overrides), x, x[self._diode_nodes[:, 0]] - x[self._diode_nodes[:, 1]])
+        return x
+
+    # Transient
+
+    def _step(self, time:float, h:float, state:tuple, depth:int=0, integration:str=None) -> tuple:
+        """ Advances 'state' (x, diode voltages, capacitor voltages and currents) from 'time' by 'h'. """
+        x, vd, vc, ic = state
+        integration = integration or self.integration
+        if (h, integration) not in self._linear_cache:
+            self._linear_cache[(h, integration)] = self._linear_matrix(h, integration)
+        trapezoidal = integration == 'trapezoidal'
+        factor = 2 if trapezoidal else 1
+
+        rhs = self._source_vector(time + h)
+        if len(vc):
+            conductance = factor * self._capacitances / h
+            history = conductance * vc + (ic if trapezoidal else 0)
+            rhs += np.bincount(self._capacitor_nodes[:, 0], history, minlength=self._size + 1) \
+                - np.bincount(self._capacitor_nodes[:, 1], history, minlength=self._size + 1)
+        for k, a, b, inductance in self._inductors:
+            rhs[k] = -factor * inductance / h * x[k] - ((x[a] - x[b]) if trapezoidal else 0)
+        try:
+            x_new, vd_new = self._newton(self._linear_cache[(h, integration)], rhs, x, vd)
+        except ConvergenceError:
+            if depth >= self.max_halvings:
+                raise
+            state = self._step(time, h / 2, state, depth + 1, integration)
+            return self._step(time + h / 2, h / 2, state, depth + 1, integration)
+        if len(vc):
+            vc_new = x_new[self._capacitor_nodes[:, 0]] - x_new[self._capacitor_nodes[:, 1]]
+            ic = conductance * (vc_new - vc) - (ic if trapezoidal else 0)
+            vc = vc_new
+        return x_new, vd_new, vc, ic
+
+    def _transient(self, parameters) -> TransientAnalysis:
+        step_time = float(parameters.step_time)
+        end_time = float(parameters.end_time)
+        start_time = float(parameters.start_time)
+        h = min(step_time, float(parameters.max_time)) if parameters.max_time is not None else step_time
+        self._build(h)
+        self._linear_cache = dict()
+        self._dc_linear = self._linear_matrix(None)
+
+        if parameters.use_initial_condition:
+            x = np.zeros(self._size + 1)
+            node_index = {name.lower(): k for k, name in enumerate(self._node_names)}
+            for key, value in self._initial_condition.items():
+                name = (key[2:-1] if key.upper().startswith('V(') else key).lower()
+                if name in node_index:
+                    x[node_index[name]] = _spice_number(value)
+        else:
+            x = self._dc_solution(0)
+        state = (x, x[self._diode_nodes[:, 0]] - x[self._diode_nodes[:, 1]],
+            x[self._capacitor_nodes[:, 0]] - x[self._capacitor_nodes[:, 1]], np.zeros(len(self._capacitances)))
+
+        n_steps = int(math.ceil(end_time / h - 1e-9))
+        times = np.minimum(np.arange(n_steps + 1) * h, end_time)
+        results = np.empty((n_steps + 1, self._size))
+        results[0] = state[0][:-1]
+        for step in range(n_steps):
+            # Same h for all but the last step, so the companion matrices are reused
+            # The capacitor currents at t=0 are unknown, so start with a backward Euler step as SPICE does
+            state = self._step(times[step], h if step + 1 < n_steps else end_time - times[step], state,
+                integration='euler' if step == 0 else None)
+            results[step + 1] = state[0][:-1]
+        keep = times >= start_time
+        return self._to_analysis(TransientAnalysis, 'time', times[keep], results[keep])
+
+    # Analyses
+
+    def _to_analysis(self, analysis_class, abscissa_name:str, abscissa, results:np.ndarray):
+        n_nodes = len(self._node_names)
+        arrays = {'node:' + name.lower(): results[:, k] for k, name in enumerate(self._node_names) if '#' not in name}
+        arrays.update({'branch:' + name.lower(): results[:, n_nodes + k] for k, name in enumerate(self._branch_names)})
+        kwargs = dict()
+        if abscissa_name is not None:
+            abscissa = _arrays_to_waveforms('', {abscissa_name: np.asarray(abscissa, dtype=np.float64)})[0]
+            kwargs[abscissa_name] = abscissa
+        return analysis_class(simulation=self, nodes=_arrays_to_waveforms('node:', arrays, abscissa),
+            branches=_arrays_to_waveforms('branch:', arrays, abscissa), internal_parameters=[], **kwargs)
+
+    def _operating_point(self, parameters) -> OperatingPoint:
+        self._build()
+        self._dc_linear = self._linear_matrix(None)
+        return self._to_analysis(OperatingPoint, None, None, self._dc_solution(0)[None, :-1])
+
+    def _dc(self, parameters) -> DcAnalysis:
+        if len(parameters.parameters) != 4:
+            raise ValueError("Only single source DC sweeps are supported.")
+        variable, start, stop, step = parameters.parameters
+        self._build()
+        self._dc_linear = self._linear_matrix(None)
+        name = variable.lower()
+        if name not in [source[0] for source in self._voltage_sources + self._current_sources]:
+            raise ValueError("DC sweep variable '{}' is not a supported source.".format(variable))
+        sweep = np.arange(float(start), float(stop) + float(step) / 2, float(step))
+
+        results = np.empty((len(sweep), self._size))
+        x = None
+        for i, value in enumerate(sweep):
+            # Warm start from the previous point
+            x = self._dc_solution(0, {name: value}, x)
+            results[i] = x[:-1]
+        return self._to_analysis(DcAnalysis, 'sweep', sweep, results)
+
+    def _run(self, analysis_method, *args, **kwargs):
+        super()._run(analysis_method, *args, **kwargs)
+        # analysis method: (SPICE analysis name, runner)
+        runners = {'operating_point': ('op', self._operating_point), 'dc': ('dc', self._dc),
+            'transient': ('tran', self._transient)}
+        if analysis_method not in runners:
+            self.reset_analysis()
+            raise ValueError("Analysis '{}' is not supported by {}.".format(analysis_method, type(self).__name__))
+        analysis_name, runner = runners[analysis_method]
+        parameters = self._analyses[analysis_name]
+        self.reset_analysis()
+        return runner(parameters)
+
+# circuit.simulator(simulator=name) backends on top of PySpice's own
+SIMULATOR_BACKENDS = {'numpy-mna': MnaCircuitSimulator}
+
+_pyspice_simulator_factory = CircuitSimulator.factory.__func__
+
+def _simulator_factory(cls, circuit, *args, **kwargs):
+    backend = SIMULATOR_BACKENDS.get(kwargs.get('simulator'))
+    if backend is None:
+        return _pyspice_simulator_factory(cls, circuit, *args, **kwargs)
+    del kwargs['simulator']
+    return backend(circuit, *args, **kwargs)
+
+CircuitSimulator.factory = classmethod(_simulator_factory)
+
+class LinearStateSpace:
+    """ 
+    State-space model dx/dt = A x + B u, y = C x + D u of a linear circuit (R, C, L and sources).
+    States are the capacitor voltages and inductor currents, inputs the independent V/I sources
+    (their waveforms are ignored, each is an input), outputs node voltages.
+    Built by solving the resistive network with capacitors as voltage sources and inductors as
+    current sources, so loops of capacitors (and voltage sources) and cutsets of inductors
+    (and current sources) raise ValueError.
+    """
+
+    def __init__(self, A, B, C, D, state_names:Sequence, input_names:Sequence, output_names:Sequence):
+        self.A, self.B, self.C, self.D = (np.atleast_2d(np.asarray(matrix, dtype=np.float64)) for matrix in (A, B, C, D))
+        self.state_names = list(state_names)
+        self.input_names = list(input_names)
+        self.output_names = list(output_names)
+
+    @classmethod
+    def from_circuit(cls, circuit:Circuit, outputs:Sequence=None):
+        """ 'outputs' are node names, every node by default. """
+        simulator = MnaCircuitSimulator(circuit)
+        simulator._build()
+        if len(simulator._diode_is):
+            raise ValueError("Circuit '{}' is not linear (diodes).".format(circuit.title))
+        n_nodes = len(simulator._node_names)
+        cls._check_topology(circuit, simulator)
+        # Resistive network: node voltages, V source currents, capacitor currents, then ground
+        n_voltage_sources = len(simulator._voltage_sources)
+        size = n_nodes + n_voltage_sources + len(simulator._capacitances)
+        def node(index):
+            return size if index == simulator._size else index
+        resistors = [(node(a), node(b), conductance) for a, b, conductance in simulator._resistors]
+        capacitors = [(node(a), node(b)) for a, b in simulator._capacitor_nodes]
+        inductors = [(k, node(a), node(b), value) for k, a, b, value in simulator._inductors]
+        voltage_sources = [(name, k, node(a), node(b)) for name, k, a, b, _ in simulator._voltage_sources]
+        current_sources = [(name, node(a), node(b)) for name, a, b, _ in simulator._current_sources]
+
+        matrix = np.zeros((size + 1, size + 1))
+        for a, b, conductance in resistors:
+            matrix[[a, b, a, b], [a, b, b, a]] += (conductance, conductance, -conductance, -conductance)
+        branches = [(n_nodes + j, a, b) for j, (_, _, a, b) in enumerate(voltage_sources)] + \
+            [(n_nodes + n_voltage_sources + j, a, b) for j, (a, b) in enumerate(capacitors)]
+        for k, a, b in branches:
+            matrix[[a, b, k, k], [k, k, a, b]] += (1, -1, 1, -1)
+        matrix[np.arange(n_nodes), np.arange(n_nodes)] += MnaCircuitSimulator.GMIN
+        matrix = matrix[:size, :size]
+
+        # One right-hand side per state (capacitor voltage, inductor current) and input
+        columns = []
+        for j in range(len(capacitors)):
+            rhs = np.zeros(size + 1)
+            rhs[n_nodes + n_voltage_sources + j] = 1
+            columns.append(rhs)
+        for _, a, b, _ in inductors:
+            rhs = np.zeros(size + 1)
+            rhs[a] -= 1
+            rhs[b] += 1
+            columns.append(rhs)
+        for j in range(n_voltage_sources):
+            rhs = np.zeros(size + 1)
+            rhs[n_nodes + j] = 1
+            columns.append(rhs)
+        for _, a, b in current_sources:
+            rhs = np.zeros(size + 1)
+            rhs[a] -= 1
+            rhs[b] += 1
+            columns.append(rhs)
+        solution = np.zeros((size + 1, len(columns)))
+        if columns:
+            solution[:size] = np.linalg.solve(matrix, np.stack(columns, axis=1)[:size])
+
+        n_states = len(capacitors) + len(inductors)
+        capacitor_currents = solution[n_nodes + n_voltage_sources:size]
+        inductor_voltages = np.array([solution[a] - solution[b] for _, a, b, _ in inductors]).reshape(-1, len(columns))
+        derivatives = np.vstack((capacitor_currents / simulator._capacitances[:, None],
+            inductor_voltages / np.array([value for *_, value in inductors]).reshape(-1, 1)))
+
+        node_names = [name for name in simulator._node_names if '#' not in name]
+        output_names = list(outputs) if outputs is not None else node_names
+        lower_names = [name.lower() for name in simulator._node_names]
+        rows = [lower_names.index(str(name).lower()) for name in output_names]
+        outputs = solution[rows]
+
+        state_names = ['v({},{})'.format(*(simulator._node_names[index] if index < n_nodes else '0' for index in nodes))
+            for nodes in capacitors] + [simulator._branch_names[k - n_nodes] for k, *_ in inductors]
+        input_names = [name for name, *_ in voltage_sources] + [name for name, *_ in current_sources]
+        return cls(derivatives[:, :n_states], derivatives[:, n_states:], outputs[:, :n_states], outputs[:, n_states:],
+            state_names, input_names, output_names)
+
+    @staticmethod
+    def _check_topology(circuit:Circuit, simulator:'MnaCircuitSimulator'):
+        """ 
+        Raises ValueError for loops of capacitors and voltage sources, and for cutsets of
+        inductors and current sources: their states are not independent. Checked on the graph
+        alone, GMIN would otherwise hide them behind huge eigenvalues.
+        """
+        n_nodes = len(simulator._node_names)
+        def node(index):
+            return n_nodes if index == simulator._size else int(index)
+        def components(edges):
+            parent = list(range(n_nodes + 1))  # ground is the last index
+            def root(index):
+                while parent[index] != index:
+                    parent[index] = parent[parent[index]]
+                    index = parent[index]
+                return index
+            loop = False
+            for a, b in edges:
+                a, b = root(node(a)), root(node(b))
+                loop = loop or a == b
+                parent[a] = b
+            return loop, len({root(index) for index in range(len(parent))})
+
+        capacitors = list(simulator._capacitor_nodes)
+        voltage_sources = [(a, b) for _, _, a, b, _ in simulator._voltage_sources]
+        resistors = [(a, b) for a, b, _ in simulator._resistors]
+        if components(capacitors + voltage_sources)[0]:
+            raise ValueError("Circuit '{}' has a loop of capacitors and voltage sources.".format(circuit.title))
+        if components(resistors + capacitors + voltage_sources)[1] > 1:
+            raise ValueError("Circuit '{}' has a cutset of inductors and current sources.".format(circuit.title))
+
+    def discretize(self, sample_rate:float) -> tuple:
+        """ Exact zero-order hold discretisation (matrix exponential), returns (Ad, Bd, Cd, Dd). """
+        Ad, Bd, Cd, Dd, _ = signal.cont2discrete((self.A, self.B, self.C, self.D), 1 / sample_rate, method='zoh')
+        return Ad, Bd, Cd, Dd
+
+    def filter(self, sample_rate:float, input:str=None, outputs:Sequence=None) -> 'LinearNetworkFilter':
+        return LinearNetworkFilter(self, sample_rate, input=input, outputs=outputs)
+
+class LinearNetworkFilter:
+    """ 
+    A LinearStateSpace discretised exactly at 'sample_rate' for one input (the others held at 0),
+    as second-order sections per output. 'process' streams chunks of any length through
+    signal.sosfilt, carrying the filter state between chunks.
+    """
+
+    def __init__(self, state_space:LinearStateSpace, sample_rate:float, input:str=None, outputs:Sequence=None):
+        self.state_space = state_space
+        self.sample_rate = sample_rate
+        self.input = input if input is not None else state_space.input_names[0]
+        self.outputs = list(outputs) if outputs is not None else state_space.output_names
+        input_index = [name.lower() for name in state_space.input_names].index(self.input.lower())
+        Ad, Bd, Cd, Dd = state_space.discretize(sample_rate)
+        output_rows = [[str(name).lower() for name in state_space.output_names].index(str(output).lower())
+            for output in self.outputs]
+        self.sos = []
+        self.delays = []
+        for row in output_rows:
+            if not len(Ad):
+                # Purely resistive path
+                self.sos.append(np.array([[Dd[row, input_index], 0, 0, 1, 0, 0]]))
+                self.delays.append(0)
+                continue
+            with warnings.catch_warnings():
+                # ss2tf leaves exact leading zeros in the numerator of strictly proper systems
+                warnings.simplefilter('ignore', signal.BadCoefficients)
+                zeros, poles, gain = signal.ss2zpk(Ad, Bd[:, [input_index]], Cd[[row]], Dd[[row]][:, [input_index]])
+            zeros = np.ravel(zeros)
+            # zpk2sos pads missing zeros at z=0, which drops the ZOH delay, so delay the input instead
+            self.sos.append(signal.zpk2sos(zeros, poles, gain))
+            self.delays.append(len(poles) - len(zeros))
+        self.reset()
+
+    def reset(self, initial_input:float=None):
+        """ Circuit at rest, or in steady state for a constant 'initial_input'. """
+        value = initial_input if initial_input is not None else 0.0
+        self._zi = [signal.sosfilt_zi(sos) * value for sos in self.sos]
+        self._history = [np.full(delay, value) for delay in self.delays]
+
+    def process(self, chunk:Sequence) -> np.ndarray:
+        """ Next chunk of input samples -> (outputs, samples) array. """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        result = np.empty((len(self.sos), len(chunk)))
+        for k, sos in enumerate(self.sos):
+            delayed = np.concatenate((self._history[k], chunk))
+            self._history[k] = delayed[len(chunk):]
+            result[k], self._zi[k] = signal.sosfilt(sos, delayed[:len(chunk)], zi=self._zi[k])
+        return result
+
+    def stream(self, chunks) -> Iterator:
+        """ Yields process(chunk) for each chunk, e.g. of iter_num_chunks_from_text_file. """
+        for chunk in chunks:
+            yield self.process(chunk)
+
+
+def overlap_save(values:Sequence, impulse_response:Sequence, fft_size:int=None) -> np.ndarray:
+    """ 
+    Convolution of 'values' (one capture, or captures stacked along the first axes) with a FIR
+    'impulse_response' by FFT overlap-save, truncated to the input length like a causal filter.
+    'fft_size' defaults to the power of two above 4 times the impulse response length.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    impulse_response = np.asarray(impulse_response, dtype=np.float64)
+    taps = len(impulse_response)
+    n_samples = values.shape[-1]
+    if fft_size is None:
+        fft_size = 1 << max(int(4 * taps - 1).bit_length(), 8)
+    if fft_size < taps:
+        raise ValueError("fft_size {} is shorter than the impulse response ({} taps).".format(fft_size, taps))
+    step = fft_size - taps + 1
+    n_blocks = max(-(-n_samples // step), 1)
+
+    # taps - 1 samples of zero history, then enough padding to complete the last block
+    padding = [(0, 0)] * (values.ndim - 1) + [(taps - 1, n_blocks * step - n_samples)]
+    padded = np.pad(values, padding)
+    blocks = np.lib.stride_tricks.sliding_window_view(padded, fft_size, axis=-1)[..., ::step, :][..., :n_blocks, :]
+    spectrum = np.fft.rfft(impulse_response, fft_size)
+    convolved = np.fft.irfft(np.fft.rfft(blocks, axis=-1) * spectrum, fft_size, axis=-1)[..., taps - 1:]
+    return convolved.reshape(values.shape[:-1] + (-1,))[..., :n_samples]
+
+class FrequencyResponse:
+    """ 
+    Transfer functions H(f) from one input source to node voltages of a linear network, sampled
+    on the uniform grid 0, df, ..., sample_rate/2 with df = sample_rate / taps.
+    Their impulse responses (inverse real FFT, 'taps' samples long) turn any capture sampled at
+    'sample_rate' into the transient outputs by FFT convolution, see convolve.
+    The impulse response is periodic in 'taps' samples, it must have settled within that length.
+    """
+
+    def __init__(self, frequencies:Sequence, responses:dict, sample_rate:float):
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.responses = {str(name).lower(): np.asarray(response, dtype=np.complex128)
+            for name, response in responses.items()}
+        self.sample_rate = float(sample_rate)
+        self._impulse_responses = dict()
+
+    @classmethod
+    def from_analysis(cls, analysis:AcAnalysis, sample_rate:float, nodes:Sequence=None, dc_gains:dict=None):
+        """ 
+        From a linear AC sweep over df, 2 df, ..., sample_rate/2 with a unit AC source.
+        AC analyses cannot run at 0 Hz, 'dc_gains' gives H(0) per node (see
+        characterise_frequency_response). Without it H(0) is extrapolated from the real part at
+        df and 2 df, which is biased unless df is far below the poles.
+        """
+        frequencies = np.concatenate(([0.0], np.array(analysis.frequency).real))
+        names = list(nodes) if nodes is not None else [name for name in analysis.nodes if '#' not in name]
+        waveforms = {str(name).lower(): waveform for name, waveform in analysis.nodes.items()}
+        dc_gains = {str(name).lower(): gain for name, gain in (dc_gains or {}).items()}
+        responses = dict()
+        for name in names:
+            response = np.array(waveforms[str(name).lower()], dtype=np.complex128)
+            dc = dc_gains.get(str(name).lower())
+            if dc is None:
+                dc = (4 * response[0].real - response[1].real) / 3 if len(response) > 1 else response[0].real
+            responses[name] = np.concatenate(([dc], response))
+        return cls(frequencies, responses, sample_rate)
+
+    @property
+    def taps(self) -> int:
+        return 2 * (len(self.frequencies) - 1)
+
+    @property
+    def nodes(self) -> list:
+        return list(self.responses)
+
+    def impulse_response(self, node:str=None) -> np.ndarray:
+        """ Discrete impulse response of 'node' (the first node by default), sum(h) = H(0). """
+        node = str(node).lower() if node is not None else self.nodes[0]
+        if node not in self._impulse_responses:
+            self._impulse_responses[node] = np.fft.irfft(self.responses[node], self.taps)
+        return self._impulse_responses[node]
+
+    def convolve(self, values:Sequence, node:str=None, fft_size:int=None) -> np.ndarray:
+        """ 
+        Output of 'node' for input 'values' sampled at sample_rate, the network starting at rest.
+        'values' may stack several captures along its first axes, see overlap_save.
+        """
+        return overlap_save(values, self.impulse_response(node), fft_size=fft_size)
+
+@contextlib.contextmanager
+def _characterisation_source(circuit:Circuit, source:str):
+    """ 
+    Temporarily replaces the value of the V/I source element 'source' (e.g. 'Vinput'),
+    yields a function setting it to 'dc <value> ac 1'.
+    """
+    element = circuit.element(source)
+    value = element.dc_value
+    def set_dc(dc_value:float):
+        element.dc_value = 'dc {} ac 1'.format(str_spice(dc_value))
+    try:
+        yield set_dc
+    finally:
+        element.dc_value = value
+
+def characterise_frequency_response(
+        circuit:Circuit, sample_rate:float, duration:float, source:str='Vinput', nodes:Sequence=None,
+        cache:SimulationCache=None, **simulator_kwargs) -> FrequencyResponse:
+    """ 
+    One linear AC analysis of 'circuit' from 'source' over sample_rate / taps ... sample_rate / 2,
+    where taps = 'duration' * sample_rate is the impulse response length, and H(0) from the
+    difference of two operating points with the source at 0 and 1 (other sources keep their bias).
+    The source's own waveform is replaced meanwhile, an external one becomes a plain DC/AC source.
+    Results go through a SimulationCache (keyed by the rendered netlist and analysis), so a
+    characterised network is only simulated once, later captures only cost the FFT convolution.
+    Only meaningful for linear networks, diodes would be linearised at their operating point.
+    """
+    taps = 2 * max(int(round(duration * sample_rate / 2)), 1)
+    cache = cache if cache is not None else SimulationCache()
+    with _characterisation_source(circuit, source) as set_dc:
+        operating_points = []
+        for dc_value in (0, 1):
+            set_dc(dc_value)
+            operating_points.append(cache.run(circuit.simulator(**simulator_kwargs), 'operating_point'))
+        analysis = cache.run(circuit.simulator(**simulator_kwargs), 'ac', variation='lin',
+            number_of_points=taps // 2, start_frequency=sample_rate / taps, stop_frequency=sample_rate / 2)
+    rest, unit = ({str(name).lower(): float(np.array(waveform).real.ravel()[0])
+        for name, waveform in point.nodes.items()} for point in operating_points)
+    dc_gains = {name: unit[name] - rest[name] for name in unit}
+    response = FrequencyResponse.from_analysis(analysis, sample_rate, nodes=nodes, dc_gains=dc_gains)
+
+    for node in response.nodes:
+        magnitude = np.abs(response.responses[node])
+        impulse_response = response.impulse_response(node)
+        energy = np.sum(impulse_response ** 2)
+        if magnitude[-1] > 1e-3 * magnitude.max():
+            # The FIR aliases what lies above sample_rate / 2, and rings over its whole length
+            logger.warning("Response of '{}' is not negligible at {} Hz, increase sample_rate.".format(
+                node, sample_rate / 2))
+        elif energy and np.sum(impulse_response[-max(taps // 10, 1):] ** 2) > 1e-6 * energy:
+            logger.warning("Impulse response of '{}' has not settled within {} s, increase duration.".format(
+                node, duration))
+    return response
+
+
+def cross_check_mna(
+        circuit:Circuit, step_time:float, end_time:float, nodes:Sequence=None,
+        voltage_sources:dict=None, current_sources:dict=None, voltage_source=None, **simulator_kwargs) -> dict:
+    """ 
+    Runs the same transient with ngspice and MnaCircuitSimulator on the same external sources.
+    Returns {'errors': {node: max |MNA - ngspice|}, 'ngspice_seconds', 'mna_seconds'},
+    compared on ngspice's timepoints, for 'nodes' or every node both report.
+    """
+    with get_ngspice_pool().borrow() as ngspice_shared:
+        ngspice_shared.set_sources(voltage_sources, current_sources)
+        if voltage_source is not None:
+            ngspice_shared.set_waveform(voltage_source=voltage_source, step_time=step_time, end_time=end_time)
+        simulator = circuit.simulator(simulator='ngspice-shared', ngspice_shared=ngspice_shared, **simulator_kwargs)
+        start = time.perf_counter()
+        reference = simulator.transient(step_time=step_time, end_time=end_time)
+        ngspice_seconds = time.perf_counter() - start
+
+        simulator = circuit.simulator(simulator='numpy-mna', ngspice_shared=ngspice_shared, **simulator_kwargs)
+        start = time.perf_counter()
+        candidate = simulator.transient(step_time=step_time, end_time=end_time)
+        mna_seconds = time.perf_counter() - start
+
+    nodes = nodes if nodes is not None else [name for name in reference.nodes if name in candidate.nodes]
+    times = np.array(reference.time)
+    errors = {node: float(np.max(np.abs(
+        np.interp(times, np.array(candidate.time), np.array(candidate[node])) - np.array(reference[node]))))
+        for node in nodes}
+    return {'errors': errors, 'ngspice_seconds': ngspice_seconds, 'mna_seconds': mna_seconds}
+
+def cross_check_circuits(step_time:float=1e-6, end_time:float=20e-3) -> dict:
+    """ cross_check_mna on the topologies we run: the pickup clamp, an RC low-pass and a series RLC. """
+    times = np.arange(int(round(end_time / step_time)) + 1) * step_time
+    source = WaveformSource(times, 5 * np.sin(2 * np.pi * 200 * times))
+    circuits = dict()
+
+    circuits['pickup clamp'] = pickup_sensor_circuit(source)
+
+    circuit = Circuit("RC low-pass")
+    circuit.PulseVoltageSource('input', 'input', circuit.gnd, initial_value=0@u_V, pulsed_value=1@u_V,
+        pulse_width=2@u_ms, period=4@u_ms, rise_time=10@u_us, fall_time=10@u_us)
+    circuit.R(1, 'input', 'output', 1@u_kOhm)
+    circuit.C(1, 'output', circuit.gnd, 1@u_uF)
+    circuits['RC low-pass'] = circuit
+
+    circuit = Circuit("Series RLC")
+    circuit.SinusoidalVoltageSource('input', 'input', circuit.gnd, amplitude=1@u_V, frequency=1@u_kHz)
+    circuit.R(1, 'input', 'a', 10@u_Ohm)
+    circuit.L(1, 'a', 'b', 10@u_mH)
+    circuit.C(1, 'b', circuit.gnd, 2.533@u_uF)
+    circuits['series RLC'] = circuit
+
+    reports = dict()
+    for name, circuit in circuits.items():
+        reports[name] = cross_check_mna(circuit, step_time, end_time, voltage_source=source,
+            temperature=25, nominal_temperature=25)
+        print("{:>14}: max error {:.3g} V, ngspice {:.3f} s, MNA {:.3f} s".format(name,
+            max(reports[name]['errors'].values()), reports[name]['ngspice_seconds'], reports[name]['mna_seconds']))
+    return reports
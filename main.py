@@ -4,7 +4,10 @@ from lib import *
 
 
 @click.command()
-def cli():
+@click.option('--source-mode', type=click.Choice(SOURCE_MODES), default='callback',
+    help="How the recorded waveform is fed to ngspice.")
+@click.option('--benchmark', is_flag=True, help="Compare the source modes on the same capture.")
+def cli(source_mode, benchmark):
     click.echo("Hi!")
     # what_is_unit()
     # circuit1()
@@ -13,7 +16,10 @@ def cli():
     # read_num_from_text_file()
     # rectifier_circuit()
     # engine_pickup_sensor_circuit()
-    engine_pickup_sensor_circuit_2()
+    if benchmark:
+        benchmark_source_modes()
+    else:
+        engine_pickup_sensor_circuit_2(source_mode=source_mode)
 
 if __name__ == "__main__":
     cli()
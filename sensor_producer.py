@@ -0,0 +1,35 @@
+import click
+import numpy as np
+
+from lib import iter_num_chunks_from_text_file, serve_samples
+
+
+def synthetic_pickup_chunks(frequency:float, sample_rate:float, amplitude:float=1.0, chunk_size:int=1024):
+    """ Endless pickup-like waveform: a sine with a sharp pulse once per period. """
+    start = 0
+    while True:
+        t = (start + np.arange(chunk_size)) / sample_rate
+        phase = (t * frequency) % 1.0
+        yield amplitude * (0.2 * np.sin(2 * np.pi * phase) + np.exp(-((phase - 0.5) / 0.01)**2) *
+            np.sign(np.sin(2 * np.pi * 50 * (phase - 0.5))))
+        start += chunk_size
+
+
+@click.command()
+@click.option('--port', type=int, default=50007, help="TCP port on localhost.")
+@click.option('--unix', 'unix_path', type=click.Path(), default=None, help="Unix socket path, instead of TCP.")
+@click.option('--file', 'filename', type=click.Path(), default=None,
+    help="Capture with one number per line, instead of the synthetic waveform.")
+@click.option('--sample-rate', type=float, default=1e6, help="Samples per second.")
+@click.option('--frequency', type=float, default=20.0, help="Synthetic waveform frequency (Hz).")
+@click.option('--no-realtime', is_flag=True, help="Send as fast as possible.")
+def cli(port, unix_path, filename, sample_rate, frequency, no_realtime):
+    """ Stand-in for the bench DAQ, streams float32 samples to MyNgSpiceShared.from_socket. """
+    address = unix_path if unix_path is not None else ('127.0.0.1', port)
+    blocks = iter_num_chunks_from_text_file(filename, chunk_size=1024, dtype=np.float32) \
+        if filename is not None else synthetic_pickup_chunks(frequency, sample_rate)
+    click.echo("Serving on {}".format(address))
+    serve_samples(address, blocks, sample_rate=None if no_realtime else sample_rate)
+
+if __name__ == "__main__":
+    cli()
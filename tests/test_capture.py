@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+import lib
+
+
+def _write(tmp_path, text):
+    path = tmp_path / 'capture.csv'
+    path.write_text(text)
+    return str(path)
+
+def test_read_scope_csv_quoted_fields(tmp_path):
+    path = _write(tmp_path, '"Time","CH1"\n"0.0","1"\n"0.001","2.5"\n"0.002","-1e-3"\n')
+    capture = lib.read_scope_csv(path)
+    np.testing.assert_allclose(capture.times, [0.0, 0.001, 0.002])
+    np.testing.assert_allclose(capture['CH1'], [1.0, 2.5, -1e-3])
+
+def test_read_scope_csv_trailing_delimiter(tmp_path):
+    path = _write(tmp_path, 'TIME,CH1,\n0.0,1,\n0.001,2,\n0.002,3,\n')
+    capture = lib.read_scope_csv(path, time_column='TIME')
+    np.testing.assert_allclose(capture.times, [0.0, 0.001, 0.002])
+    np.testing.assert_allclose(capture['CH1'], [1.0, 2.0, 3.0])
+
+def test_read_scope_csv_skips_junk_rows(tmp_path):
+    path = _write(tmp_path, 'Model,TDS\nTIME,CH1,CH2\n0,1,2\nbad,row,here\n1,3,4\n')
+    capture = lib.read_scope_csv(path, chunk_size=2)
+    np.testing.assert_allclose(capture.times, [0.0, 1.0])
+    np.testing.assert_allclose(capture['CH2'], [2.0, 4.0])
+
+def test_read_scope_csv_without_numeric_rows(tmp_path):
+    with pytest.raises(ValueError):
+        lib.read_scope_csv(_write(tmp_path, 'TIME,CH1\n'))
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Unit import *
+
+import lib
+
+
+def _rc():
+    circuit = Circuit('rc')
+    circuit.V('input', 'input', circuit.gnd, 0@u_V)
+    circuit.R(1, 'input', 'output', 1@u_kOhm)
+    circuit.C(1, 'output', circuit.gnd, 1@u_uF)
+    return circuit
+
+def test_rc_step_response():
+    state_space = lib.LinearStateSpace.from_circuit(_rc(), outputs=['output'])
+    network_filter = state_space.filter(1e5)
+    outputs = np.concatenate([network_filter.process(chunk) for chunk in np.array_split(np.ones(1000), 7)], axis=1)
+    times = np.arange(1000) / 1e5
+    np.testing.assert_allclose(outputs[0], 1 - np.exp(-times / 1e-3), atol=1e-8)
+
+def test_series_inductors_are_an_inductor_cutset():
+    circuit = Circuit('series inductors')
+    circuit.V('input', 'input', circuit.gnd, 0@u_V)
+    circuit.R(1, 'input', 'a', 10@u_Ohm)
+    circuit.L(1, 'a', 'b', 1@u_mH)
+    circuit.L(2, 'b', 'c', 1@u_mH)
+    circuit.R(2, 'c', circuit.gnd, 10@u_Ohm)
+    with pytest.raises(ValueError, match='cutset'):
+        lib.LinearStateSpace.from_circuit(circuit)
+
+def test_capacitor_across_source_is_a_capacitor_loop():
+    circuit = _rc()
+    circuit.C(2, 'input', circuit.gnd, 1@u_uF)
+    with pytest.raises(ValueError, match='loop'):
+        lib.LinearStateSpace.from_circuit(circuit)
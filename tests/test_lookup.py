@@ -0,0 +1,21 @@
+import numpy as np
+
+import lib
+
+
+def test_closest_input_for_output_returns_stored_objects():
+    ragged = {0: [1], 1: [1, 2], 2: [1, 2, 3]}
+    assert lib.closest_input_for_output(ragged, 1.2) is ragged[1]
+    equal = {0: [1, 2], 10: [3, 4]}
+    assert lib.closest_input_for_output(equal, 8) is equal[10]
+    value = lib.closest_input_for_output({0: 1, 10: 2}, 4)
+    assert value == 1 and type(value) is int
+
+def test_closest_input_for_output_ties_and_empty():
+    assert lib.closest_input_for_output({0: 'a', 2: 'b'}, 1) == 'a'
+    assert lib.closest_input_for_output({}, 1) is None
+
+def test_sorted_lookup_modes():
+    lookup = lib.SortedLookup.from_dict({2: 20, 0: 0, 1: 10}, mode='linear')
+    np.testing.assert_allclose(lookup([0.5, 1.5, 5]), [5, 15, 20])
+    assert lookup(0.9, mode='nearest') == 10
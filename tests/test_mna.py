@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Unit import *
+
+import lib
+
+
+def test_mna_rejects_raw_spice():
+    circuit = Circuit('raw')
+    circuit.raw_spice = 'V1 a 0 5'
+    circuit.R(1, 'a', circuit.gnd, 1@u_kOhm)
+    with pytest.raises(ValueError):
+        circuit.simulator(simulator='numpy-mna').operating_point()
+
+def test_mna_rejects_pwl_source_mode():
+    source = lib.WaveformSource.from_samples(np.ones(10), 1e-6)
+    circuit = lib.pickup_sensor_circuit(source, source_mode='pwl')
+    with pytest.raises(ValueError):
+        circuit.simulator(simulator='numpy-mna').transient(step_time=1e-6, end_time=5e-6)
@@ -0,0 +1,54 @@
+import pytest
+
+import lib
+
+
+class FakeInstance:
+
+    created = 0
+    fail_creation = False
+
+    def __init__(self, ngspice_id=0, **kwargs):
+        if FakeInstance.fail_creation:
+            raise OSError('cannot load ngspice')
+        FakeInstance.created += 1
+        self.ngspice_id = ngspice_id
+        self.quit_called = False
+        self._ngspice_shared = None
+
+    def remove_circuit(self):
+        pass
+
+    def destroy(self, plot_name='all'):
+        pass
+
+    def exec_command(self, command):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_failed_job_recycles_the_instance():
+    FakeInstance.fail_creation = False
+    pool = lib.NgSpicePool(size=1, factory=FakeInstance, copy_library=False)
+    with pytest.raises(RuntimeError):
+        with pool.borrow() as instance:
+            raise RuntimeError('job failed')
+    assert instance.quit_called
+    with pool.borrow(timeout=1) as replacement:
+        assert replacement is not instance
+    assert pool.recycled == 1
+
+def test_failed_replacement_drops_the_slot():
+    FakeInstance.fail_creation = False
+    pool = lib.NgSpicePool(size=1, factory=FakeInstance, copy_library=False)
+    FakeInstance.fail_creation = True
+    try:
+        with pytest.raises(OSError):
+            with pool.borrow() as instance:
+                raise RuntimeError('job failed')
+    finally:
+        FakeInstance.fail_creation = False
+    assert pool._idle.empty()
+    assert id(instance) not in pool._records
@@ -0,0 +1,27 @@
+import os
+import threading
+
+import numpy as np
+
+import lib
+
+
+def _serve(address, values):
+    ready = threading.Event()
+    thread = threading.Thread(target=lib.serve_samples, args=(address, np.array_split(values, 100)),
+        kwargs={'ready': ready}, daemon=True)
+    thread.start()
+    ready.wait(5)
+    return thread
+
+def test_block_mode_throttles_a_fast_producer(tmp_path):
+    address = os.path.join(str(tmp_path), 'samples.sock')
+    values = np.arange(50000, dtype=np.float64)
+    thread = _serve(address, values)
+    with lib.SocketWaveformSource(address, 1e3, capacity=1024, back_pressure='block',
+            interpolation='hold', history=128) as source:
+        served = np.array([source(k / 1e3) for k in range(len(values))])
+    thread.join(5)
+    assert source.overruns == 0
+    assert source.underruns == 0
+    np.testing.assert_array_equal(served, values)
@@ -0,0 +1,101 @@
+import math
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PySpice.Spice.Netlist import Circuit
+from PySpice.Unit import *
+
+import lib
+
+
+class FakeNgSpiceShared(lib.MyNgSpiceShared):
+    """ 
+    Stands in for libngspice: bg_run replays 'output(k)' through send_data from a background
+    thread, ngSpice_running() follows that thread. Like PySpice, '_is_running' ends up True
+    once the thread is over (BGThreadRunning passes 'not running').
+    """
+
+    def __init__(self, points:int, output, step_time:float=1e-6):
+        self.points = points
+        self.output = output
+        self.step_time = step_time
+        self.end_time = points * step_time
+        self.recorder = None
+        self.instrument = False
+        self.sent = 0
+        self._send_data_c = object()
+        self._is_running = False
+        self._running = False
+        self._halt = threading.Event()
+        self._ngspice_shared = SimpleNamespace(ngSpice_running=lambda: self._running)
+
+    def destroy(self, plot_name='all'):
+        pass
+
+    def load_circuit(self, circuit):
+        self.circuit = circuit
+
+    def run(self, background=False):
+        self._halt.clear()
+        self._running = True
+        self._is_running = True
+        threading.Thread(target=self._background_run, daemon=True).start()
+
+    def _background_run(self):
+        for k in range(self.points):
+            if self._halt.is_set():
+                break
+            self.send_data({'time': complex(k * self.step_time), 'V(output)': complex(self.output(k))}, 2, 0)
+            self.sent += 1
+            if k % 100 == 0:
+                time.sleep(1e-4)
+        self._running = False
+        self._is_running = True
+
+    def halt(self):
+        self._halt.set()
+
+    @property
+    def last_plot(self):
+        return 'tran1'
+
+    def plot(self, simulation, plot_name):
+        return SimpleNamespace(to_analysis=lambda: SimpleNamespace(plot_name=plot_name))
+
+
+def _simulator(ngspice_shared):
+    circuit = Circuit('rc')
+    circuit.V('input', 'input', circuit.gnd, 'dc 0 external')
+    circuit.R(1, 'input', 'output', 1@u_kOhm)
+    circuit.C(1, 'output', circuit.gnd, 1@u_uF)
+    return circuit.simulator(simulator='ngspice-shared', ngspice_shared=ngspice_shared)
+
+def test_stream_transient_records_the_whole_run():
+    ngspice_shared = FakeNgSpiceShared(5000, lambda k: 1 - math.exp(-k / 1000))
+    recorder = lib.StreamingRecorder(vectors=('time', 'output'), capacity=512)
+    result = lib.stream_transient(_simulator(ngspice_shared), 1e-6, 5e-3, recorder=recorder, poll_interval=1e-3)
+    assert result is recorder
+    assert recorder.rows == 5000
+    assert recorder.stop_reason is None
+    np.testing.assert_allclose(recorder['time'], np.arange(5000) * 1e-6)
+    assert ngspice_shared.recorder is None
+
+def test_stream_transient_recorder_reuses_its_buffers():
+    ngspice_shared = FakeNgSpiceShared(100, lambda k: 0.0)
+    recorder = lib.StreamingRecorder(vectors=('time', 'output'), capacity=128, buffers=2)
+    buffers = list(recorder._free.queue) + [recorder._buffer]
+    for _ in range(5):
+        lib.stream_transient(_simulator(ngspice_shared), 1e-6, 1e-4, recorder=recorder, poll_interval=1e-3)
+        assert recorder.rows == 100
+        assert any(recorder._buffer is buffer for buffer in buffers)
+
+def test_transient_until_halts_at_the_stop_condition():
+    # Square wave with a 200 point period, the second rising edge is at point 300
+    ngspice_shared = FakeNgSpiceShared(100000, lambda k: float((k // 100) % 2))
+    condition = lib.ThresholdCrossings('output', 0.5, count=2)
+    analysis = lib.transient_until(_simulator(ngspice_shared), 1e-6, 0.1, [condition])
+    assert analysis.stop_reason is condition
+    assert 300 < ngspice_shared.sent < ngspice_shared.points
+    assert not ngspice_shared.is_running